@@ -24,10 +24,15 @@
 
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, MAX_SHOW_ALL_ALLOWED
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect
 
 from crm import models as crm
+from crm import selections
+from crm.paginators import EstimatedCountPaginator
+from crm.templatetags.crm_tags import load_interaction_contacts
 
 
 class BusinessTypeAdmin(admin.ModelAdmin):
@@ -40,19 +45,72 @@ class RelationshipType(admin.ModelAdmin):
 admin.site.register(crm.RelationshipType, RelationshipType)
 
 
+class InteractionChangeList(ChangeList):
+    """
+    Counts large tables from their estimate and loads the participants of
+    the whole page in one query.
+    """
+    
+    def get_results(self, request):
+        paginator = EstimatedCountPaginator(self.query_set, self.list_per_page)
+        result_count = paginator.count
+        
+        if paginator.estimated or not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = EstimatedCountPaginator(
+                self.root_query_set,
+                self.list_per_page,
+            ).count
+        
+        can_show_all = not paginator.estimated and \
+                       result_count <= MAX_SHOW_ALL_ALLOWED
+        multi_page = result_count > self.list_per_page
+        
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                result_list = ()
+        
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = load_interaction_contacts(result_list)
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
 class InteractionAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('date', 'type', 'completed', 'participants')
+    list_filter = ('type', 'completed')
+    date_hierarchy = 'date'
+    raw_id_fields = ('contacts',)
+    
+    def get_changelist(self, request, **kwargs):
+        return InteractionChangeList
+    
+    def participants(self, interaction):
+        contacts = getattr(interaction, 'contact_list', None)
+        if contacts is None:
+            contacts = interaction.contacts.all()
+        return u', '.join([unicode(contact) for contact in contacts])
 admin.site.register(crm.Interaction, InteractionAdmin)
 
 
 def send_account_activation_email(modeladmin, request, queryset):
-    selected = request.POST.getlist(admin.ACTION_CHECKBOX_NAME)
-    selected = ["ids=%d" % pk for pk in selected]
+    if request.POST.get('select_across') == '1':
+        # everything matching the current filters; keep the query, not ids
+        token = selections.store_selection(request, queryset=queryset)
+    else:
+        token = selections.store_selection(
+            request,
+            ids=request.POST.getlist(admin.ACTION_CHECKBOX_NAME),
+        )
     url = reverse('create_registration')
-    return HttpResponseRedirect("%s?%s" % (
-        url,
-        "&".join(selected)
-    ))
+    return HttpResponseRedirect("%s?selection=%s" % (url, token))
 
 
 class ContactAdmin(admin.ModelAdmin):
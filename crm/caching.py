@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Generation-based invalidation for values kept in the Django cache.
+
+Cached values include the current generation of the data they were built
+from in their keys.  Bumping a generation makes every key built from the
+old one unreachable, so nothing has to be deleted explicitly; the stale
+entries simply expire.
+
+A bump only reaches the processes that share the cache, so production
+sites with more than one worker need a shared CACHE_BACKEND (memcached,
+the database or files).  With the default per-process locmem backend,
+timeout() caps every generation-keyed value at CRM_LOCAL_CACHE_SECONDS
+(60 by default), which bounds how long other workers serve stale data.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
+
+# long enough to outlive anything keyed on a generation, short enough for
+# memcached not to read it as a timestamp
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+DEFAULT_LOCAL_CACHE_SECONDS = 60
+
+
+def is_shared():
+    """
+    Whether the cache is seen by every process, i.e. not locmem.
+    """
+    return not type(cache).__module__.endswith('.locmem')
+
+
+def timeout(seconds):
+    """
+    Returns seconds, capped at CRM_LOCAL_CACHE_SECONDS when the cache isn't
+    shared between processes.
+    """
+    if is_shared():
+        return seconds
+    return min(seconds, getattr(
+        settings,
+        'CRM_LOCAL_CACHE_SECONDS',
+        DEFAULT_LOCAL_CACHE_SECONDS,
+    ))
+
+
+def _generation_key(name):
+    return 'crm-generation-%s' % name
+
+
+def get_generation(name):
+    key = _generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        # start from the clock so a lost counter can't reuse an old value
+        generation = int(time.time() * 1000)
+        if not cache.add(key, generation, GENERATION_TIMEOUT):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(name):
+    try:
+        cache.incr(_generation_key(name))
+    except ValueError:
+        cache.set(
+            _generation_key(name),
+            int(time.time() * 1000),
+            GENERATION_TIMEOUT,
+        )
+
+
+def make_key(prefix, *parts):
+    """
+    Returns a cache key that is safe for memcached, whatever the parts.
+    """
+    digest = md5_constructor('|'.join([smart_str(p) for p in parts]))
+    return 'crm-%s-%s' % (prefix, digest.hexdigest())
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.utils.functional import LazyObject
 
 from crm.forms import QuickSearchForm
 
@@ -11,7 +12,35 @@ def crm_settings(request):
     return context
 
 
+class LazyQuickSearchForm(LazyObject):
+    """
+    Defers building the QuickSearchForm until a template actually uses it.
+    Special methods are looked up on the class, so the ones templates rely
+    on are proxied explicitly.
+    """
+    
+    def _setup(self):
+        self._wrapped = QuickSearchForm()
+    
+    def _form(self):
+        if self._wrapped is None:
+            self._setup()
+        return self._wrapped
+    
+    def __unicode__(self):
+        return unicode(self._form())
+    
+    def __str__(self):
+        return str(self._form())
+    
+    def __getitem__(self, name):
+        return self._form()[name]
+    
+    def __iter__(self):
+        return iter(self._form())
+
+
 def quick_search(request):
     return {
-        'quick_search_form': QuickSearchForm(),
+        'quick_search_form': LazyQuickSearchForm(),
     }
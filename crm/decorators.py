@@ -1,10 +1,74 @@
 import base64
+import hmac
+import time
 
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth import authenticate, login
+from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.models import User
 from django.http import HttpResponse, HttpResponseRedirect
+from django.utils.hashcompat import sha_hmac
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
+from crm import permissions
+from crm import stats
+from crm.instrumentation import QueryCapture
+
+
+def _render(view_func, template_name, *args, **kwargs):
+    request = args[0]
+    response = view_func(*args, **kwargs)
+    
+    if isinstance(response, HttpResponse):
+        if isinstance(response, HttpResponseRedirect) and \
+          'next' in request.REQUEST:
+            return HttpResponseRedirect(request.REQUEST['next'])
+        else:
+            return response
+    else:
+        # assume response is a context dictionary
+        context = response
+        return render_to_response(
+            template_name, 
+            context, 
+            context_instance=RequestContext(request),
+        )
+
+
+def _measured(view_func, template_name, *args, **kwargs):
+    """
+    _render() with the query count and time, view and template render
+    times and response size recorded in crm.stats.
+    """
+    timings = {}
+    def timed_view(*args, **kwargs):
+        start = time.time()
+        try:
+            return view_func(*args, **kwargs)
+        finally:
+            timings['view'] = time.time() - start
+    
+    capture = QueryCapture().start()
+    start = time.time()
+    try:
+        response = _render(timed_view, template_name, *args, **kwargs)
+    finally:
+        total = time.time() - start
+        capture.stop()
+    view_time = timings.get('view', total)
+    stats.view_stats.record(
+        view_func.__name__,
+        status=response.status_code,
+        queries=capture.count,
+        query_ms=capture.time * 1000,
+        view_ms=view_time * 1000,
+        render_ms=(total - view_time) * 1000,
+        response_bytes=len(response.content),
+    )
+    return response
+
 
 def render_with(template_name):
     """
@@ -14,30 +78,93 @@ def render_with(template_name):
     
     If the view returns an HttpResponseRedirect, the decorator will redirect
     to the given URL, or to request.REQUEST['next'] (if it exists).
+    
+    With CRM_VIEW_STATS enabled each request is measured; see crm.stats.
     """
     def render_with_decorator(view_func):
         def wrapper(*args, **kwargs):
-            request = args[0]
-            response = view_func(*args, **kwargs)
-            
-            if isinstance(response, HttpResponse):
-                if isinstance(response, HttpResponseRedirect) and \
-                  'next' in request.REQUEST:
-                    return HttpResponseRedirect(request.REQUEST['next'])
-                else:
-                    return response
-            else:
-                # assume response is a context dictionary
-                context = response
-                return render_to_response(
-                    template_name, 
-                    context, 
-                    context_instance=RequestContext(request),
-                )
+            if stats.enabled():
+                return _measured(view_func, template_name, *args, **kwargs)
+            return _render(view_func, template_name, *args, **kwargs)
         return wrapper
     return render_with_decorator
 
 
+def permission_required(*perms):
+    """
+    Like django.contrib.auth.decorators.permission_required, but takes any
+    number of permissions and checks them all in one pass against the
+    user's cached permissions (see crm.permissions):
+    
+    @permission_required('crm.add_business', 'crm.change_business')
+    """
+    return user_passes_test(
+        lambda u: permissions.for_user(u).has_perms(perms),
+    )
+
+
+DEFAULT_BASICAUTH_CACHE_SECONDS = 60
+
+
+def _basicauth_cache_key(header):
+    # never put the credentials themselves in the cache
+    digest = hmac.new(settings.SECRET_KEY, header, sha_hmac).hexdigest()
+    return 'crm-basicauth-%s' % digest
+
+
+def _password_digest(user):
+    # nor the password hash, which could be brute-forced offline
+    return hmac.new(settings.SECRET_KEY, user.password, sha_hmac).hexdigest()
+
+
+def basicauth_user(header):
+    """
+    Returns the active user identified by the given HTTP Basic
+    Authorization header, or None.
+    
+    Verified credentials are cached for CRM_BASICAUTH_CACHE_SECONDS (set it
+    to 0 to disable) so that repeated calls skip the password hash.  The
+    cached entry remembers an HMAC of the user's password hash and is
+    ignored as soon as the password changes.
+    """
+    auth = header.split()
+    # NOTE: We are only supporting basic authentication for now.
+    if len(auth) != 2 or auth[0].lower() != "basic":
+        return None
+    timeout = getattr(
+        settings,
+        'CRM_BASICAUTH_CACHE_SECONDS',
+        DEFAULT_BASICAUTH_CACHE_SECONDS,
+    )
+    key = _basicauth_cache_key(header)
+    if timeout:
+        verified = cache.get(key)
+        if verified:
+            try:
+                user = User.objects.get(pk=verified['user_id'])
+            except User.DoesNotExist:
+                user = None
+            if user and user.is_active and \
+              _password_digest(user) == verified['password']:
+                user.backend = verified['backend']
+                return user
+            cache.delete(key)
+    try:
+        uname, passwd = base64.b64decode(auth[1]).split(':', 1)
+    except (TypeError, ValueError):
+        return None
+    user = authenticate(username=uname, password=passwd)
+    if user is None or not user.is_active:
+        return None
+    if timeout:
+        cache.set(key, {
+            'user_id': user.pk,
+            'password': _password_digest(user),
+            'backend': user.backend,
+        }, timeout)
+    return user
+
+
 # based on http://www.djangosnippets.org/snippets/243/
 def view_or_basicauth(view, request, test_func, realm='', *args, **kwargs):
     """
@@ -45,6 +172,9 @@ def view_or_basicauth(view, request, test_func, realm='', *args, **kwargs):
     'has_perm_or_basicauth' that does the nitty of determining if they
     are already logged in or if they have provided proper http-authorization
     and returning the view if all goes well, otherwise responding with a 401.
+    
+    Set CRM_BASICAUTH_CREATE_SESSION to False to keep Basic auth requests
+    stateless, i.e. to skip logging the user in and writing a session.
     """
     if test_func(request.user):
         # Already logged in, just return the view.
@@ -52,18 +182,13 @@ def view_or_basicauth(view, request, test_func, realm='', *args, **kwargs):
 
     # They are not logged in. See if they provided login credentials
     if 'HTTP_AUTHORIZATION' in request.META:
-        auth = request.META['HTTP_AUTHORIZATION'].split()
-        if len(auth) == 2:
-            # NOTE: We are only supporting basic authentication for now.
-            if auth[0].lower() == "basic":
-                uname, passwd = base64.b64decode(auth[1]).split(':')
-                user = authenticate(username=uname, password=passwd)
-                if user is not None:
-                    if user.is_active:
-                        login(request, user)
-                        request.user = user
-                        if test_func(user):
-                            return view(request, *args, **kwargs)
+        user = basicauth_user(request.META['HTTP_AUTHORIZATION'])
+        if user is not None:
+            if getattr(settings, 'CRM_BASICAUTH_CREATE_SESSION', True):
+                login(request, user)
+            request.user = user
+            if test_func(user):
+                return view(request, *args, **kwargs)
 
     # Either they did not provide an authorization header or
     # something in the authorization attempt failed. Send a 401
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Duplicate contact detection and merging.
+
+Rather than comparing every pair of contacts, each contact is assigned a
+few blocking keys (normalized e-mail, phonetic last name plus first
+initial, phone digits and external id) in one pass over the table, and
+only contacts that share a key are compared.
+"""
+
+import re
+import string
+import difflib
+import unicodedata
+
+from django.db import transaction
+
+from contactinfo import models as contactinfo
+
+from crm import caching
+from crm import models as crm
+from crm.models import normalize_email
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_BLOCK_SIZE = 200
+CANDIDATE_BATCH_SIZE = 500
+
+SOUNDEX_CODES = {}
+for _digit, _letters in (
+    ('1', 'bfpv'),
+    ('2', 'cgjkqsxz'),
+    ('3', 'dt'),
+    ('4', 'l'),
+    ('5', 'mn'),
+    ('6', 'r'),
+):
+    for _letter in _letters:
+        SOUNDEX_CODES[_letter] = _digit
+
+# fields copied from a merged duplicate when they are blank on the contact
+# that is kept
+MERGE_FIELDS = (
+    'name',
+    'first_name',
+    'middle_name',
+    'last_name',
+    'email',
+    'description',
+    'notes',
+    'external_id',
+)
+
+
+def _ascii_letters(s):
+    s = unicodedata.normalize('NFKD', unicode(s)).encode('ascii', 'ignore')
+    return [c for c in s.lower() if c in string.ascii_lowercase]
+
+
+def soundex(s):
+    """
+    Returns the American Soundex code of s, e.g. 'R163' for 'Robert'.
+    """
+    letters = _ascii_letters(s)
+    if not letters:
+        return ''
+    codes = []
+    previous = SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        code = SOUNDEX_CODES.get(letter, '')
+        if code and code != previous:
+            codes.append(code)
+        # 'h' and 'w' don't separate letters with the same code
+        if letter not in 'hw':
+            previous = code
+    return (letters[0].upper() + ''.join(codes) + '000')[:4]
+
+
+def normalize_phone(number):
+    digits = re.sub('[^0-9]', '', number or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    if len(digits) < 7:
+        return ''
+    return digits
+
+
+class Candidate(object):
+    """
+    The parts of a contact needed to block and compare it.
+    """
+    __slots__ = ('pk', 'type', 'name', 'first_name', 'last_name', 'email',
+                 'phones', 'external_id')
+    
+    def __init__(self, pk, type, name, first_name, last_name, email,
+                 external_id):
+        self.pk = pk
+        self.type = type
+        self.first_name = first_name.strip().lower()
+        self.last_name = last_name.strip().lower()
+        if type == 'individual':
+            name = '%s %s' % (first_name, last_name)
+        self.name = ' '.join(name.lower().split())
+        self.email = normalize_email(email)
+        self.external_id = external_id.strip()
+        self.phones = ()
+    
+    def blocking_keys(self):
+        keys = []
+        if self.email:
+            keys.append(('email', self.email))
+        if self.type == 'individual':
+            code = soundex(self.last_name)
+            initial = _ascii_letters(self.first_name)[:1]
+            if code and initial:
+                keys.append(('name', self.type, code, initial[0]))
+        else:
+            words = self.name.split()
+            if words:
+                keys.append(('name', self.type, soundex(words[0])))
+        for phone in self.phones:
+            keys.append(('phone', phone))
+        if self.external_id:
+            keys.append(('external_id', self.external_id))
+        return keys
+
+
+def _add_phones(candidates):
+    """
+    Fills in the phones of a batch of candidates.  values_list() can't
+    follow the locations many-to-many or the phones reverse key, so this
+    reads the contact/location table and then the locations' phones.
+    """
+    by_pk = dict([(candidate.pk, candidate) for candidate in candidates])
+    locations = {}
+    for contact_id, location_id in crm.Contact.locations.through.objects.filter(
+        contact__in=by_pk.keys(),
+    ).values_list('contact', 'location'):
+        locations.setdefault(location_id, []).append(by_pk[contact_id])
+    if not locations:
+        return
+    for location_id, number in contactinfo.Phone.objects.filter(
+        location__in=locations.keys(),
+    ).values_list('location', 'number'):
+        phone = normalize_phone(number)
+        if not phone:
+            continue
+        for candidate in locations[location_id]:
+            if phone not in candidate.phones:
+                candidate.phones += (phone,)
+
+
+def iter_candidates(queryset=None, batch_size=CANDIDATE_BATCH_SIZE):
+    """
+    Streams Candidates for the contacts in queryset (all contacts by
+    default), reading their phone numbers batch_size contacts at a time.
+    """
+    if queryset is None:
+        queryset = crm.Contact.objects.all()
+    rows = queryset.order_by('pk').values_list(
+        'pk',
+        'type',
+        'name',
+        'first_name',
+        'last_name',
+        'email',
+        'external_id',
+    ).iterator()
+    batch = []
+    for row in rows:
+        batch.append(Candidate(*row))
+        if len(batch) >= batch_size:
+            _add_phones(batch)
+            for candidate in batch:
+                yield candidate
+            batch = []
+    if batch:
+        _add_phones(batch)
+        for candidate in batch:
+            yield candidate
+
+
+def similarity(a, b):
+    """
+    Returns a score between 0 and 1 of how likely a and b are the same
+    contact.  Fields that are blank on either side don't count.
+    """
+    if a.type != b.type:
+        return 0.0
+    scores = [
+        (2, difflib.SequenceMatcher(None, a.name, b.name).ratio()),
+    ]
+    if a.email and b.email:
+        scores.append((2, float(a.email == b.email)))
+    if a.phones and b.phones:
+        scores.append((1, float(bool(set(a.phones) & set(b.phones)))))
+    if a.external_id and b.external_id:
+        scores.append((2, float(a.external_id == b.external_id)))
+    total = sum([weight for weight, score in scores])
+    return sum([weight * score for weight, score in scores]) / total
+
+
+def find_duplicates(queryset=None, threshold=DEFAULT_THRESHOLD,
+                    max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """
+    Returns a list of (score, contact_id, other_contact_id) candidate
+    duplicate pairs scoring at least threshold, best first.
+    
+    Blocks larger than max_block_size (e.g. a shared office number) are
+    skipped, since they say little about any single pair and would make
+    the comparison quadratic again.
+    """
+    candidates = {}
+    blocks = {}
+    for candidate in iter_candidates(queryset):
+        candidates[candidate.pk] = candidate
+        for key in candidate.blocking_keys():
+            blocks.setdefault(key, []).append(candidate.pk)
+    compared = set()
+    pairs = []
+    for pks in blocks.itervalues():
+        if len(pks) < 2 or len(pks) > max_block_size:
+            continue
+        for i, pk in enumerate(pks):
+            for other in pks[i + 1:]:
+                if (pk, other) in compared:
+                    continue
+                compared.add((pk, other))
+                score = similarity(candidates[pk], candidates[other])
+                if score >= threshold:
+                    pairs.append((score, pk, other))
+    pairs.sort(reverse=True)
+    return pairs
+
+
+def _repoint_m2m(through, field, keep, duplicate, other_field):
+    """
+    Moves duplicate's rows in an m2m table to keep, dropping the ones keep
+    already has.
+    """
+    existing = through.objects.filter(**{field: keep}).values_list(
+        other_field,
+        flat=True,
+    )
+    through.objects.filter(**{field: duplicate}).exclude(**{
+        '%s__in' % other_field: list(existing),
+    }).update(**{field: keep})
+    through.objects.filter(**{field: duplicate}).delete()
+
+
+def _repoint_relationships(keep, duplicate):
+    relationships = crm.ContactRelationship.objects
+    # relationships between the two contacts would become self-references
+    relationships.filter(from_contact=duplicate, to_contact=keep).delete()
+    relationships.filter(from_contact=keep, to_contact=duplicate).delete()
+    for field, other_field in (
+        ('from_contact', 'to_contact'),
+        ('to_contact', 'from_contact'),
+    ):
+        existing = relationships.filter(**{field: keep}).values_list(
+            other_field,
+            flat=True,
+        )
+        relationships.filter(**{field: duplicate}).exclude(**{
+            '%s__in' % other_field: list(existing),
+        }).update(**{field: keep})
+        relationships.filter(**{field: duplicate}).delete()
+
+
+class MergeError(Exception):
+    pass
+
+
+def _unique_with(model, field_name):
+    """
+    Returns the other fields of each unique constraint on model that
+    includes field_name (an empty list if the field itself is unique).
+    """
+    others = []
+    if model._meta.get_field(field_name).unique:
+        others.append([])
+    for fields in model._meta.unique_together:
+        if field_name in fields:
+            others.append([f for f in fields if f != field_name])
+    return others
+
+
+def _repoint_fk(model, field_name, keep, duplicate):
+    """
+    Moves the rows of model that point at duplicate to keep.  Raises
+    MergeError rather than break a unique constraint.
+    """
+    manager = model._base_manager
+    rows = manager.filter(**{field_name: duplicate})
+    for others in _unique_with(model, field_name):
+        kept = manager.filter(**{field_name: keep})
+        if others:
+            existing = set(kept.values_list(*others))
+            colliding = [r for r in rows.values_list(*others) if r in existing]
+        else:
+            colliding = kept.exists() and rows.exists()
+        if colliding:
+            raise MergeError(
+                'Both contacts have a %s with the same %s' % (
+                    model._meta.verbose_name,
+                    ', '.join(others) or field_name,
+                )
+            )
+    rows.update(**{field_name: keep})
+
+
+def _repoint_related(keep, duplicate):
+    """
+    Moves every row that refers to duplicate, in any installed app, to
+    keep.
+    """
+    opts = crm.Contact._meta
+    for related in opts.get_all_related_objects():
+        if related.model is crm.ContactRelationship:
+            continue
+        _repoint_fk(related.model, related.field.name, keep, duplicate)
+    for related in opts.get_all_related_many_to_many_objects():
+        through = related.field.rel.through
+        # rows of explicit through models are repointed as foreign keys
+        if through._meta.auto_created:
+            _repoint_m2m(
+                through,
+                related.field.m2m_reverse_field_name(),
+                keep,
+                duplicate,
+                related.field.m2m_field_name(),
+            )
+    for field in opts.local_many_to_many:
+        through = field.rel.through
+        if through._meta.auto_created:
+            _repoint_m2m(
+                through,
+                field.m2m_field_name(),
+                keep,
+                duplicate,
+                field.m2m_reverse_field_name(),
+            )
+    _repoint_relationships(keep, duplicate)
+
+
+def merge_contacts(keep, duplicates):
+    """
+    Merges each contact in duplicates into keep and deletes them.
+    Everything that refers to a duplicate, in this or any other installed
+    app, is repointed to keep with bulk updates, and blank fields on keep
+    are filled in from the duplicates.  Raises MergeError, leaving every
+    contact untouched, if a row can't be repointed.
+    """
+    for duplicate in duplicates:
+        if duplicate.pk == keep.pk:
+            continue
+        _repoint_related(keep, duplicate)
+        for field in MERGE_FIELDS:
+            if not getattr(keep, field) and getattr(duplicate, field):
+                setattr(keep, field, getattr(duplicate, field))
+        user = duplicate.user
+        duplicate.delete()
+        if not keep.user and user:
+            keep.user = user
+    keep.save()
+    # the bulk updates above send no signals
+    caching.bump_generation('contacts')
+    caching.bump_generation('project_relationships')
+    return keep
+merge_contacts = transaction.commit_on_success(merge_contacts)
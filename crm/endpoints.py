@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+The CRM's pages, lookup channels and XML-RPC methods as callables, with
+inputs taken from the database, for the audit and benchmark commands.
+"""
+
+import xmlrpclib
+
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.http import HttpRequest
+from django.test import Client
+from django.utils.importlib import import_module
+
+from contactinfo import models as contactinfo
+
+from crm import models as crm
+from crm import lookups
+from crm import xmlrpc
+
+
+def login_client(user):
+    """
+    Returns a test Client logged in as user, without needing the user's
+    password.
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    request = HttpRequest()
+    request.session = engine.SessionStore()
+    user.backend = 'django.contrib.auth.backends.ModelBackend'
+    login(request, user)
+    request.session.save()
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = request.session.session_key
+    return client
+
+
+def _first(queryset):
+    try:
+        return queryset[0]
+    except IndexError:
+        return None
+
+
+def _reverse(name, kwargs=None):
+    try:
+        return reverse(name, kwargs=kwargs)
+    except NoReverseMatch:
+        return None
+
+
+def endpoints(client):
+    """
+    Returns (name, callable) pairs, one per page, lookup channel and
+    XML-RPC method.  Pages that change data are only requested with GET,
+    and pages needing a kind of object the database lacks are left out.
+    Lookups and XML-RPC calls go through the client when the project
+    routes them, and are called directly otherwise.
+    """
+    person = _first(crm.Contact.objects.filter(type='individual'))
+    business = _first(crm.Contact.objects.filter(type='business'))
+    interaction = _first(crm.Interaction.objects.all())
+    registration = _first(crm.LoginRegistration.objects.filter(
+        activated=False,
+    ))
+    relationship = _first(crm.ContactRelationship.objects.filter(
+        from_contact__type='business',
+        to_contact__type='individual',
+    ))
+    phone = _first(contactinfo.Phone.objects.all())
+    user = _first(User.objects.filter(contacts__isnull=False))
+    term = 'a'
+    if person and person.last_name:
+        term = person.last_name[:3]
+    
+    pages = [
+        ('crm_dashboard', {}, ''),
+        ('list_interactions', {}, ''),
+        ('create_interaction', {}, ''),
+        ('list_people', {}, ''),
+        ('list_people', {}, '?search=%s' % term),
+        ('create_person', {}, ''),
+        ('register_person', {}, ''),
+        ('list_businesses', {}, ''),
+        ('list_businesses', {}, '?search=%s' % term),
+        ('create_business', {}, ''),
+        ('address_book', {'file_name': 'gs_phonebook.xml'}, ''),
+        ('crm_view_stats', {}, ''),
+    ]
+    if person:
+        pages.extend([
+            ('view_person', {'person_id': person.pk}, ''),
+            ('edit_person', {'person_id': person.pk}, ''),
+            ('person_history', {'person_id': person.pk}, ''),
+            ('create_interaction', {'person_id': person.pk}, ''),
+            ('create_registration', {}, '?ids=%d' % person.pk),
+            ('quick_search', {}, '?quick_search=individual-%d' % person.pk),
+        ])
+        if person.slug:
+            pages.append(('email_contact', {'contact_slug': person.slug}, ''))
+    if business:
+        pages.extend([
+            ('view_business', {'business_id': business.pk}, ''),
+            ('edit_business', {'business_id': business.pk}, ''),
+        ])
+    if relationship:
+        pages.append((
+            'edit_business_relationship',
+            {
+                'business_id': relationship.from_contact_id,
+                'user_id': relationship.to_contact_id,
+            },
+            '',
+        ))
+    if interaction:
+        pages.extend([
+            ('edit_interaction', {'interaction_id': interaction.pk}, ''),
+            ('remove_interaction', {'interaction_id': interaction.pk}, ''),
+        ])
+    if registration:
+        pages.append((
+            'activate_login',
+            {'activation_key': registration.activation_key},
+            '',
+        ))
+    
+    result = []
+    for name, kwargs, query in pages:
+        url = _reverse(name, kwargs)
+        if url is not None:
+            result.append((
+                name + query,
+                lambda url=url + query: client.get(url),
+            ))
+    
+    channels = (
+        ('contact', lookups.ContactLookup),
+        ('quick_search', lookups.QuickLookup),
+    )
+    for channel, lookup in channels:
+        url = _reverse('ajax_lookup', {'channel': channel})
+        if url is not None:
+            func = lambda url=url: client.get(url, {'q': term})
+        else:
+            func = lambda lookup=lookup: list(lookup().get_query(term, None))
+        result.append(('lookup ' + channel, func))
+    
+    calls = []
+    if phone:
+        calls.append(('callerid', (phone.number,)))
+        calls.append(('callerid_batch', ([phone.number],)))
+    if user and xmlrpc.timepiece:
+        calls.append(('project_relationships', ('', user.username)))
+        calls.append(('project_relationships_batch', ('', [user.username])))
+    rpc_url = _reverse('xml_rpc')
+    for method, params in calls:
+        if rpc_url is not None:
+            body = xmlrpclib.dumps(params, method)
+            func = lambda body=body: client.post(
+                rpc_url,
+                body,
+                content_type='text/xml',
+            )
+        else:
+            func = lambda method=method, params=params: \
+                getattr(xmlrpc, method)(*params)
+        result.append(('xmlrpc ' + method, func))
+    return result
@@ -26,13 +26,17 @@ from django.core.mail import EmailMessage, send_mail, send_mass_mail
 from django.template.loader import render_to_string
 from django.template import RequestContext
 from django.core.urlresolvers import reverse
+from django.utils.encoding import force_unicode
+from django.utils.translation import get_language
 
 from ajax_select.fields import AutoCompleteSelectMultipleField, \
                                AutoCompleteSelectField, \
                                AutoCompleteSelectWidget
 
 from crm import models as crm
+from crm import permissions
 from crm.models import slugify_uniquely
+from crm.integrations import timepiece
 from crm.widgets import DateInput
 
 def send_user_email(request, user, email_dict):
@@ -68,8 +72,10 @@ class PersonForm(forms.ModelForm):
         self.fields['email'].required = True
     
     def clean_email(self):
-        if not self.instance.id and \
-          User.objects.filter(email=self.cleaned_data['email']).count() > 0:
+        # iexact is backed by an index on UPPER(email), see migration 013
+        if not self.instance.id and User.objects.filter(
+            email__iexact=self.cleaned_data['email'].strip(),
+        ).exists():
             raise forms.ValidationError('A user with that e-mail address already exists.')
         return self.cleaned_data['email']
     
@@ -80,20 +86,18 @@ class PersonForm(forms.ModelForm):
             created = False
         else:
             try:
-                user = User.objects.get(email=self.cleaned_data['email'])
+                user = User.objects.filter(
+                    email__iexact=self.cleaned_data['email'].strip(),
+                )[0]
                 created = False
-            except User.DoesNotExist:
+            except IndexError:
                 user = super(PersonForm, self).save(commit=False)
                 created = True
                 if not email_enabled:
                     user.set_password(settings.CAKTUS_DEBUG_PASSWORD)
                 username_base = "%s%s" % (user.first_name, user.last_name)
                 if username_base == '': username_base = user.email
-                user.username = slugify_uniquely(
-                    username_base[:20], 
-                    queryset=User.objects.all(), 
-                    field='username',
-                )
+                user.username = crm.allocate_username(username_base[:20])
                 user.save()
                 self.save_m2m()
         if email_dict and email_enabled:
@@ -121,17 +125,17 @@ class ProfileForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         request = kwargs.pop('request')
         super(ProfileForm, self).__init__(*args, **kwargs)
-        if not request.user.has_perm('crm.change_contact'):
+        if not permissions.for_user(request.user).has_perm('crm.change_contact'):
             self.fields.pop('notes')
     
     def clean_email(self):
         if self.cleaned_data['email'] != '':
             emails = crm.Contact.objects.filter(
-                email=self.cleaned_data['email']
+                email_normalized=crm.normalize_email(self.cleaned_data['email'])
             )
             if self.instance.pk:
                 emails = emails.exclude(pk=self.instance.pk)
-            if emails.count() > 0:
+            if emails.exists():
                 raise forms.ValidationError('A user with that e-mail address already exists.')
         return self.cleaned_data['email']
     
@@ -167,7 +171,7 @@ class BusinessForm(forms.ModelForm):
         super(BusinessForm, self).__init__(*args, **kwargs)
 
         self.fields['business_types'].choices = \
-            list(self.fields['business_types'].choices)
+            crm.BusinessType.objects.choices()
         if len(self.fields['business_types'].choices) == 0:
             self.fields.pop('business_types')
         else:
@@ -200,6 +204,41 @@ class AssociateContactForm(forms.Form):
 
 
 class CharAutoCompleteSelectWidget(AutoCompleteSelectWidget):
+    # unbound renderings only depend on the channel, name, attrs, help text
+    # and language, so they are shared by every instance in the process
+    _static_renderings = {}
+    # distinct renderings kept before starting over, in case attrs vary
+    MAX_STATIC_RENDERINGS = 100
+    
+    def _rendering_key(self, name, attrs):
+        return (
+            self.channel,
+            name,
+            tuple(sorted((attrs or {}).items())),
+            tuple(sorted(self.attrs.items())),
+            force_unicode(getattr(self, 'help_text', '')),
+            get_language(),
+        )
+    
+    def render(self, name, value, attrs=None):
+        if value:
+            return super(CharAutoCompleteSelectWidget, self).render(
+                name,
+                value,
+                attrs,
+            )
+        key = self._rendering_key(name, attrs)
+        if key not in self._static_renderings:
+            if len(self._static_renderings) >= self.MAX_STATIC_RENDERINGS:
+                self._static_renderings.clear()
+            self._static_renderings[key] = \
+                super(CharAutoCompleteSelectWidget, self).render(
+                    name,
+                    value,
+                    attrs,
+                )
+        return self._static_renderings[key]
+    
     def value_from_datadict(self, data, files, name):
         return data.get(name, None)
 
@@ -212,10 +251,6 @@ class QuickSearchForm(forms.Form):
     
     def clean_quick_search(self):
         item = self.cleaned_data['quick_search']
-        try:
-            from timepiece import models as timepiece
-        except ImportError:
-            timepiece = None
         if timepiece and isinstance(item, timepiece.Project):
             return reverse('view_project', kwargs={
                 'business_id': item.business.id,
@@ -308,6 +343,7 @@ class ContactRelationshipForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(ContactRelationshipForm, self).__init__(*args, **kwargs)
+        self.fields['types'].choices = crm.RelationshipType.objects.choices()
         self.fields['types'].widget = forms.CheckboxSelectMultiple(
             choices=self.fields['types'].choices
         )
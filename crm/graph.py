@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Traversals of the contact relationship graph.
+
+ContactRelationship rows are always saved in pairs (see
+ContactRelationship.save), so following from_contact -> to_contact is
+enough to walk the graph in both directions.  Breadth-first searches load
+a whole level of the graph per query (in chunks, to stay below backend
+limits on query parameters) instead of one query per contact.  Where the
+backend supports recursive common table expressions, within_hops runs as
+a single query.
+"""
+
+from django.db import connection
+
+from crm import models as crm
+
+# SQLite refuses more than 999 parameters in a statement
+CHUNK_SIZE = 500
+
+
+def _pk(contact):
+    return getattr(contact, 'pk', contact)
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK_SIZE):
+        yield items[i:i + CHUNK_SIZE]
+
+
+def neighbours(contact_ids, type=None):
+    """
+    Returns a dictionary mapping each of the given contact ids to the set
+    of contact ids it is directly related to, optionally limited to
+    contacts of the given type.
+    """
+    result = dict([(pk, set()) for pk in contact_ids])
+    for chunk in _chunks(result.keys()):
+        edges = crm.ContactRelationship.objects.filter(from_contact__in=chunk)
+        if type:
+            edges = edges.filter(to_contact__type=type)
+        for from_id, to_id in edges.values_list('from_contact', 'to_contact'):
+            result[from_id].add(to_id)
+    return result
+
+
+def supports_recursive_queries():
+    engine = connection.settings_dict['ENGINE'].split('.')[-1]
+    if engine in ('postgresql', 'postgresql_psycopg2'):
+        return True
+    if engine == 'sqlite3':
+        from django.db.backends.sqlite3.base import Database
+        return Database.sqlite_version_info >= (3, 8, 3)
+    return False
+
+
+def _within_hops_recursive(contact_id, hops):
+    qn = connection.ops.quote_name
+    opts = crm.ContactRelationship._meta
+    sql = """
+        WITH RECURSIVE reachable (contact_id, depth) AS (
+            SELECT %%s, 0
+            UNION
+            SELECT r.%(to)s, reachable.depth + 1
+            FROM %(table)s r
+            JOIN reachable ON r.%(from)s = reachable.contact_id
+            WHERE reachable.depth < %%s
+        )
+        SELECT contact_id, MIN(depth) FROM reachable GROUP BY contact_id
+    """ % {
+        'table': qn(opts.db_table),
+        'from': qn(opts.get_field('from_contact').column),
+        'to': qn(opts.get_field('to_contact').column),
+    }
+    cursor = connection.cursor()
+    cursor.execute(sql, [contact_id, hops])
+    return dict(cursor.fetchall())
+
+
+def within_hops(contact, hops=2, recursive=None):
+    """
+    Returns a dictionary mapping the id of every contact within the given
+    number of hops of contact (including itself) to its distance.
+    
+    Uses a recursive query when the backend supports one, unless recursive
+    is False.
+    """
+    contact_id = _pk(contact)
+    if recursive is None:
+        recursive = supports_recursive_queries()
+    if recursive:
+        return _within_hops_recursive(contact_id, hops)
+    distances = {contact_id: 0}
+    frontier = set([contact_id])
+    for depth in range(1, hops + 1):
+        found = set()
+        for related in neighbours(frontier).itervalues():
+            found.update(related)
+        frontier = found.difference(distances)
+        if not frontier:
+            break
+        for pk in frontier:
+            distances[pk] = depth
+    return distances
+
+
+def shortest_path(contact, other, max_hops=6):
+    """
+    Returns the list of contact ids on a shortest path from contact to
+    other (both included), or None if they are more than max_hops apart.
+    
+    Searches from both ends at once, expanding the smaller side a level at
+    a time, so only about half the usual depth is loaded from each end.
+    """
+    start, end = _pk(contact), _pk(other)
+    if start == end:
+        return [start]
+    forward = {start: None}
+    backward = {end: None}
+    forward_frontier = set([start])
+    backward_frontier = set([end])
+    for hop in range(max_hops):
+        if len(forward_frontier) <= len(backward_frontier):
+            parents, frontier, others = forward, forward_frontier, backward
+        else:
+            parents, frontier, others = backward, backward_frontier, forward
+        next_frontier = set()
+        meetings = set()
+        for pk, related in neighbours(frontier).iteritems():
+            for related_pk in related:
+                if related_pk not in parents:
+                    parents[related_pk] = pk
+                    next_frontier.add(related_pk)
+                if related_pk in others:
+                    meetings.add(related_pk)
+        if parents is forward:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+        if meetings:
+            paths = [_join_path(forward, backward, pk) for pk in meetings]
+            paths.sort(key=len)
+            return paths[0]
+        if not next_frontier:
+            return None
+    return None
+
+
+def _join_path(forward, backward, meeting):
+    path = []
+    pk = meeting
+    while pk is not None:
+        path.insert(0, pk)
+        pk = forward[pk]
+    pk = backward[meeting]
+    while pk is not None:
+        path.append(pk)
+        pk = backward[pk]
+    return path
+
+
+def connected_businesses(business):
+    """
+    Returns a dictionary mapping the id of every other business that shares
+    a related individual with business to the set of those individuals' ids.
+    """
+    business_id = _pk(business)
+    people = neighbours([business_id], type='individual')[business_id]
+    connected = {}
+    for person_id, businesses in neighbours(people, type='business').items():
+        for other_id in businesses:
+            if other_id != business_id:
+                connected.setdefault(other_id, set()).add(person_id)
+    return connected
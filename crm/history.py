@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Field-level change tracking for contact profiles.
+
+Changes are computed from the initial and cleaned values of the fields
+the forms that edited the contact report as changed, so nothing has to be
+reloaded from the database to find out what changed.
+"""
+
+from django import forms
+from django.db import models
+from django.forms.formsets import BaseFormSet
+from django.utils.encoding import force_unicode
+from django.utils.functional import curry
+
+# fields tracked for each model, by model name
+TRACKED_FIELDS = {
+    'Contact': ('first_name', 'middle_name', 'last_name', 'email'),
+    'Location': ('type',),
+    'Phone': ('number',),
+    'Address': ('street', 'city', 'state_province', 'postal_code', 'country'),
+}
+
+
+def _display(value):
+    if value is None:
+        return u''
+    return force_unicode(value)
+
+
+def _tracked_fields(form):
+    model = getattr(getattr(form, '_meta', None), 'model', None)
+    if model is None:
+        return ()
+    return TRACKED_FIELDS.get(model.__name__, ())
+
+
+def _display_choice(field, value):
+    """
+    Displays a value of a model choice field the way the form shows it,
+    whether it is an instance (cleaned_data) or a key (initial).
+    """
+    if value in (None, ''):
+        return u''
+    if not isinstance(value, models.Model):
+        key = field.to_field_name or 'pk'
+        try:
+            value = field.queryset.get(**{key: value})
+        except (field.queryset.model.DoesNotExist, ValueError):
+            return _display(value)
+    return field.label_from_instance(value)
+
+
+def form_changes(form, label=None):
+    """
+    Returns a list of {'field', 'old', 'new'} dictionaries for the tracked
+    fields of a validated model form whose value changed.
+    """
+    if not hasattr(form, 'cleaned_data'):
+        return []
+    deleted = form.cleaned_data.get('DELETE', False)
+    if deleted:
+        names = _tracked_fields(form)
+    else:
+        names = [n for n in _tracked_fields(form) if n in form.changed_data]
+    changes = []
+    for name in names:
+        if name not in form.fields:
+            continue
+        field = form.fields[name]
+        if isinstance(field, forms.ModelChoiceField):
+            display = curry(_display_choice, field)
+        else:
+            display = _display
+        old = display(form.initial.get(name, field.initial))
+        if deleted:
+            new = u''
+        else:
+            new = display(form.cleaned_data.get(name))
+        if old != new:
+            field_label = force_unicode(field.label or name)
+            if label:
+                field_label = u'%s %s' % (label, field_label)
+            changes.append({'field': field_label, 'old': old, 'new': new})
+    return changes
+
+
+def changes_in(items):
+    """
+    Returns the tracked changes of every form and formset in items, which
+    may be a list of forms or a context dictionary.
+    """
+    if isinstance(items, dict):
+        items = items.values()
+    changes = []
+    for item in items:
+        if isinstance(item, BaseFormSet):
+            model = getattr(item, 'model', None)
+            if model is not None:
+                name = model.__name__
+            else:
+                name = item.prefix
+            for i, form in enumerate(item.forms):
+                changes.extend(form_changes(form, '%s %d' % (name, i + 1)))
+        elif isinstance(item, forms.BaseForm):
+            model = getattr(getattr(item, '_meta', None), 'model', None)
+            label = None
+            if model is not None and model.__name__ == 'Location':
+                label = 'Location'
+            changes.extend(form_changes(item, label))
+    return changes
+
+
+def format_changes(changes):
+    return u''.join([
+        u"%(field)s: '%(old)s' -> '%(new)s'\n" % change for change in changes
+    ])
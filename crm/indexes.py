@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Indexes behind the CRM's hot query paths, which Django can't declare on
+the models themselves (composite indexes) or which were added after the
+tables were created.
+
+Existing databases get them from migrations/014_indexes.sql and later
+migrations; tables created by syncdb get them from create_missing_indexes()
+afterwards.  The migrations use CREATE INDEX IF NOT EXISTS, so they also
+apply cleanly where syncdb got there first.  An index counts as present if
+any index on the table starts with the same columns.
+"""
+
+from django.db import connections
+
+from crm import models as crm
+
+# (index name, model, fields, the queries it serves)
+INDEXES = (
+    ('crm_contact_type_sort_name', crm.Contact, ('type', 'sort_name'),
+     'list_people, list_businesses'),
+    ('crm_contact_email_normalized', crm.Contact, ('email_normalized',),
+     'e-mail uniqueness checks, XML-RPC contact lookups'),
+    ('crm_contact_external_id', crm.Contact, ('external_id',),
+     'imports, find_duplicate_contacts'),
+    ('crm_interaction_completed_date', crm.Interaction, ('completed', 'date'),
+     'dashboard'),
+    ('crm_interaction_date', crm.Interaction, ('date',),
+     'list_interactions, view_person, interaction admin'),
+    ('crm_interaction_type_date', crm.Interaction, ('type', 'date'),
+     'interaction admin type filter'),
+    ('crm_loginregistration_activation_key', crm.LoginRegistration,
+     ('activation_key',), 'activate_login'),
+    ('crm_contactrelationship_dates', crm.ContactRelationship,
+     ('start_date', 'end_date'), 'relationship date filters'),
+    ('crm_contacthistory_contact_id_date', crm.ContactHistory,
+     ('contact', 'date'), 'person_history'),
+)
+
+
+def _columns(model, fields):
+    return tuple([model._meta.get_field(f).column for f in fields])
+
+
+def existing_indexes(table, using='default'):
+    """
+    Returns a list of the column tuples of every index on table.  Raises
+    NotImplementedError on backends it can't introspect.
+    """
+    connection = connections[using]
+    cursor = connection.cursor()
+    engine = connection.settings_dict['ENGINE'].split('.')[-1]
+    qn = connection.ops.quote_name
+    indexes = []
+    if engine == 'sqlite3':
+        cursor.execute('PRAGMA index_list(%s)' % qn(table))
+        for row in cursor.fetchall():
+            cursor.execute('PRAGMA index_info(%s)' % qn(row[1]))
+            columns = [(r[0], r[2]) for r in cursor.fetchall()]
+            columns.sort()
+            indexes.append(tuple([name for seqno, name in columns]))
+    elif engine in ('postgresql', 'postgresql_psycopg2'):
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes WHERE tablename = %s',
+            [table],
+        )
+        for (definition,) in cursor.fetchall():
+            columns = definition[definition.rindex('(') + 1:-1]
+            indexes.append(tuple([
+                c.strip().strip('"') for c in columns.split(',')
+            ]))
+    elif engine == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % qn(table))
+        by_name = {}
+        for row in cursor.fetchall():
+            by_name.setdefault(row[2], []).append((row[3], row[4]))
+        for columns in by_name.values():
+            columns.sort()
+            indexes.append(tuple([name for seqno, name in columns]))
+    else:
+        raise NotImplementedError('Index introspection is not supported '
+                                  'on %s' % engine)
+    return indexes
+
+
+def missing_indexes(models=None, using='default'):
+    """
+    Returns the entries of INDEXES, optionally only those on the given
+    models, that no index in the database covers.
+    """
+    existing = {}
+    missing = []
+    for index in INDEXES:
+        name, model, fields, purpose = index
+        if models is not None and model not in models:
+            continue
+        table = model._meta.db_table
+        if table not in existing:
+            existing[table] = existing_indexes(table, using)
+        columns = _columns(model, fields)
+        if not [c for c in existing[table] if c[:len(columns)] == columns]:
+            missing.append(index)
+    return missing
+
+
+def create_missing_indexes(verbosity=1, models=None, using='default'):
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for name, model, fields, purpose in missing_indexes(models, using):
+        if verbosity > 1:
+            print "Creating index %s for %s" % (name, purpose)
+        cursor.execute("CREATE INDEX %s ON %s (%s)" % (
+            qn(name),
+            qn(model._meta.db_table),
+            ', '.join([qn(c) for c in _columns(model, fields)]),
+        ))
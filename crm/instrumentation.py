@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Query capture for audits, benchmarks and per-view statistics.
+
+Unlike connection.queries, this works with DEBUG off and keeps each
+statement's SQL and parameters apart, so statements can be re-run (e.g.
+under EXPLAIN).
+"""
+
+import time
+
+from django.db import connection
+
+
+class CapturingCursor(object):
+    def __init__(self, cursor, capture):
+        self.cursor = cursor
+        self.capture = capture
+    
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.capture.record(sql, params, time.time() - start)
+    
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.capture.record(sql, None, time.time() - start)
+    
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+    
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class QueryCapture(object):
+    """
+    Records every statement run on the default connection between start()
+    and stop():
+    
+    capture = QueryCapture().start()
+    ...
+    capture.stop()
+    capture.count, capture.time, capture.queries
+    """
+    
+    def __init__(self):
+        self.queries = []
+        self._active = False
+        self._previous = None
+    
+    def record(self, sql, params, duration):
+        self.queries.append((sql, params, duration))
+    
+    def start(self):
+        # captures may be nested, so remember any capture already installed
+        self._previous = connection.__dict__.get('cursor')
+        original = connection.cursor
+        capture = self
+        connection.cursor = lambda: CapturingCursor(original(), capture)
+        self._active = True
+        return self
+    
+    def stop(self):
+        if self._active:
+            if self._previous is not None:
+                connection.cursor = self._previous
+            else:
+                # uncover the connection's own cursor() method
+                del connection.cursor
+            self._active = False
+        return self
+    
+    def reset(self):
+        self.queries = []
+    
+    def _get_count(self):
+        return len(self.queries)
+    count = property(_get_count)
+    
+    def _get_time(self):
+        return sum([duration for sql, params, duration in self.queries])
+    time = property(_get_time)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+The optional apps the CRM works with, each detected once per process.
+
+Python doesn't remember failed imports, so a "try: from timepiece import
+models" inside a view walks sys.path again on every request when the app
+is missing.  Use these instead:
+
+    from crm.integrations import timepiece
+    
+    if timepiece:
+        timepiece.Project.objects.filter(...)
+
+An integration is true only if its app is in INSTALLED_APPS and its models
+import, and proxies attribute access to the app's models module.  Since
+these apps import crm.models themselves, detection waits until first use.
+"""
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+
+class Integration(object):
+    def __init__(self, name, app, models_module):
+        self.name = name
+        self.app = app
+        self.models_module = models_module
+        self._models = None
+        self._detected = False
+    
+    def _detect(self):
+        if not self._detected:
+            if self.app in settings.INSTALLED_APPS:
+                try:
+                    self._models = import_module(self.models_module)
+                except ImportError:
+                    self._models = None
+            self._detected = True
+        return self._models
+    
+    def _get_available(self):
+        return self._detect() is not None
+    available = property(_get_available)
+    
+    def _get_models(self):
+        return self._detect()
+    models = property(_get_models)
+    
+    def __nonzero__(self):
+        return self.available
+    
+    def __getattr__(self, name):
+        # only called for attributes not found normally, i.e. model names
+        models = self._detect()
+        if models is None:
+            raise AttributeError(
+                '%s is not installed, so has no %s' % (self.name, name)
+            )
+        return getattr(models, name)
+    
+    def reset(self):
+        """ Detect again on next use (for tests) """
+        self._models = None
+        self._detected = False
+    
+    def __repr__(self):
+        return '<Integration %s: %s>' % (
+            self.name,
+            self.available and 'available' or 'not available',
+        )
+
+
+timepiece = Integration('timepiece', 'timepiece', 'timepiece.models')
+ledger = Integration('minibooks', 'minibooks.ledger', 'minibooks.ledger.models')
+members = Integration('members', 'members', 'members.models')
+
+INTEGRATIONS = (timepiece, ledger, members)
+
+
+def capabilities():
+    """ A dictionary of integration name -> whether it is available """
+    return dict([(i.name, i.available) for i in INTEGRATIONS])
@@ -2,24 +2,23 @@ from django.db.models import Q
 from django.core.urlresolvers import reverse
 
 from crm import models as crm
-
-try:
-    from timepiece import models as timepiece
-except ImportError:
-    timepiece = None
+from crm.routers import use_replica
+from crm.integrations import timepiece
 
 
 class ContactLookup(object):
 
+    @use_replica
     def get_query(self,q,request):
         """ return a query set.  you also have access to request.user if needed """
-        return crm.Contact.objects.filter(
+        # evaluated here, while reads may still use the replica
+        return list(crm.Contact.objects.filter(
             type='individual'
         ).filter(
             Q(first_name__icontains=q) | 
             Q(last_name__icontains=q) |
             Q(email__icontains=q)
-        ).select_related().order_by('sort_name')[:10]
+        ).select_related().order_by('sort_name')[:10])
         
     def format_item(self,contact):
         """ simple display of an object when it is displayed in the list of selected objects """
@@ -52,6 +51,7 @@ class SearchResult(object):
 
 class QuickLookup(object):
 
+    @use_replica
     def get_query(self,q,request):
         """ return a query set (or a fake one).  you also have access to request.user if needed """
         results = []
@@ -0,0 +1,31 @@
+import warnings
+
+from django.db import router
+from django.db.models import signals
+
+from crm import models as crm
+
+
+def create_indexes(sender, created_models, **kwargs):
+    """
+    Adds the hot-path indexes to the crm tables syncdb just created.
+    Existing tables get them from the SQL migrations.
+    """
+    from crm import indexes
+    db = kwargs.get('db', 'default')
+    models = [m for m in created_models if router.allow_syncdb(db, m)]
+    if not models:
+        return
+    try:
+        indexes.create_missing_indexes(
+            kwargs.get('verbosity', 1),
+            models,
+            db,
+        )
+    except NotImplementedError, e:
+        warnings.warn('Not creating CRM indexes: %s' % e)
+signals.post_syncdb.connect(
+    create_indexes,
+    sender=crm,
+    dispatch_uid='crm-create-indexes',
+)
@@ -0,0 +1,47 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from crm import models as crm
+
+
+class Command(NoArgsCommand):
+    help = "Fill in Contact.email_normalized for existing contacts"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=10000,
+            help='Number of contact ids updated per transaction '
+                 '(default: 10000)'),
+    )
+    
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        batch_size = options['batch_size']
+        qn = connection.ops.quote_name
+        opts = crm.Contact._meta
+        email = qn(opts.get_field('email').column)
+        normalized = qn(opts.get_field('email_normalized').column)
+        sql = "UPDATE %s SET %s = LOWER(TRIM(%s)) " \
+            "WHERE %s >= %%s AND %s < %%s AND %s <> LOWER(TRIM(%s))" % (
+            qn(opts.db_table),
+            normalized,
+            email,
+            qn(opts.pk.column),
+            qn(opts.pk.column),
+            normalized,
+            email,
+        )
+        max_id = crm.Contact.objects.aggregate(Max('pk'))['pk__max'] or 0
+        updated = 0
+        cursor = connection.cursor()
+        try:
+            for start in range(0, max_id + 1, batch_size):
+                cursor.execute(sql, [start, start + batch_size])
+                updated += cursor.rowcount
+                transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+        print "Normalized the e-mail address of %d contacts" % updated
@@ -0,0 +1,67 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from crm import models as crm
+from crm import rendering
+
+
+class Command(NoArgsCommand):
+    help = "Store the rendered HTML of contact descriptions and notes and " \
+           "interaction memos"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=1000,
+            help='Number of rows rendered per transaction (default: 1000)'),
+        make_option('--all', dest='all', action='store_true', default=False,
+            help='Re-render rows whose HTML is already stored, e.g. after '
+                 'upgrading the markup libraries'),
+    )
+    
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        try:
+            for model in (crm.Contact, crm.Interaction):
+                updated = self.backfill(
+                    model,
+                    options['batch_size'],
+                    options['all'],
+                )
+                print "Rendered markup for %d %s" % (
+                    updated,
+                    model._meta.verbose_name_plural,
+                )
+        except:
+            transaction.rollback()
+            raise
+    
+    def backfill(self, model, batch_size, everything):
+        fields = rendering.rendered_fields(model)
+        names = [field for field, language in fields]
+        names.extend(['%s_html' % field for field, language in fields])
+        queryset = model.objects.order_by('pk')
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list(
+                'pk',
+                *names
+            )[:batch_size])
+            if not rows:
+                break
+            for row in rows:
+                values = {}
+                for index, (field, language) in enumerate(fields):
+                    source = row[1 + index]
+                    html = row[1 + len(fields) + index]
+                    if everything or (source and not html):
+                        values['%s_html' % field] = \
+                            rendering.render(source, language)
+                # update() rather than save(): no signals, no other columns
+                if values:
+                    model.objects.filter(pk=row[0]).update(**values)
+                    updated += 1
+            transaction.commit()
+            last_pk = rows[-1][0]
+        return updated
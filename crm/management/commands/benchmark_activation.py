@@ -0,0 +1,98 @@
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from crm import models as crm
+from crm import synthetic
+from crm.instrumentation import QueryCapture
+
+
+class Command(NoArgsCommand):
+    help = "Seed login registrations and same-name users, then time the " \
+           "activation key lookup, username allocation and activation.  " \
+           "Seeded data and the --count activations are committed, so run " \
+           "it against a scratch database."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--registrations', dest='registrations', type='int',
+            default=1000000,
+            help='Pending registrations to seed (default: 1000000)'),
+        make_option('--same-name', dest='same_name', type='int',
+            default=10000,
+            help='Users sharing the activated name (default: 10000)'),
+        make_option('--no-seed', dest='seed', action='store_false',
+            default=True, help='Benchmark the data already present'),
+        make_option('--count', dest='count', type='int', default=100,
+            help='Repetitions of each timing (default: 100)'),
+    )
+    
+    def handle_noargs(self, **options):
+        if options['seed']:
+            start = time.time()
+            self.seed(options['registrations'], options['same_name'])
+            print "Seeded data in %.1f s" % (time.time() - start)
+        self.benchmark(options['count'])
+    
+    @transaction.commit_on_success
+    def seed(self, registrations, same_name):
+        contact_ids = synthetic.seed_contacts(registrations, prefix='activation')
+        synthetic.seed_registrations(contact_ids)
+        
+        def users():
+            for i in xrange(same_name):
+                yield {
+                    'username': i and 'same-name%d' % i or 'same-name',
+                    'password': '!',
+                    'is_active': True,
+                }
+        synthetic.bulk_insert(User, users())
+    
+    def benchmark(self, count):
+        keys = list(crm.LoginRegistration.objects.filter(
+            activated=False,
+        ).order_by('-pk').values_list('activation_key', flat=True)[:count])
+        self.report('activation key lookup', [
+            lambda key=key: crm.LoginRegistration.objects.select_related(
+                'contact__user',
+            ).get(activation_key=key)
+            for key in keys
+        ])
+        self.report('allocate_username', [
+            lambda: crm.allocate_username('Same Name'),
+        ] * count)
+        self.report('slugify_uniquely (before)', [
+            lambda: crm.slugify_uniquely(
+                'Same Name',
+                User.objects.all(),
+                'username',
+            ),
+        ] * count)
+        registrations = crm.LoginRegistration.objects.filter(
+            activation_key__in=keys,
+        ).select_related('contact')
+        for registration in registrations:
+            # activate every one under the crowded name
+            registration.contact.first_name = 'Same'
+            registration.contact.last_name = 'Name'
+        self.report('activate', [
+            lambda r=registration: r.activate('password')
+            for registration in registrations
+        ])
+    
+    def report(self, label, calls):
+        if not calls:
+            return
+        capture = QueryCapture().start()
+        start = time.time()
+        try:
+            for call in calls:
+                call()
+        finally:
+            capture.stop()
+        print "%-28s %8.2f ms per call  %5.1f queries per call" % (
+            label,
+            (time.time() - start) * 1000 / len(calls),
+            float(capture.count) / len(calls),
+        )
@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.utils.importlib import import_module
+
+from crm import integrations
+
+
+class Command(NoArgsCommand):
+    help = "Compare importing the optional apps on every call with the " \
+           "crm.integrations registry"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--count', dest='count', type='int', default=10000,
+            help='Number of lookups of each integration (default: 10000)'),
+    )
+    
+    def handle_noargs(self, **options):
+        count = options['count']
+        for integration in integrations.INTEGRATIONS:
+            print "%s (%s)" % (
+                integration.name,
+                integration.available and 'installed' or 'not installed',
+            )
+            
+            def per_call_import():
+                # what the call sites used to do
+                try:
+                    import_module(integration.models_module)
+                except ImportError:
+                    pass
+            self.report('import per call', per_call_import, count)
+            self.report('registry', lambda: bool(integration), count)
+    
+    def report(self, label, func, count):
+        start = time.time()
+        for i in xrange(count):
+            func()
+        elapsed = time.time() - start
+        print "    %-20s %8.2f us per call" % (
+            label,
+            elapsed / count * 1000000,
+        )
@@ -0,0 +1,86 @@
+import random
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection, transaction
+
+from crm import models as crm
+from crm import graph
+from crm import synthetic
+
+
+class Command(NoArgsCommand):
+    help = "Time relationship graph queries, optionally on a synthetic graph"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--seed-edges', dest='seed_edges', type='int', default=0,
+            help='Create a synthetic graph with this many relationship rows '
+                 'first, e.g. 1000000'),
+        make_option('--seed-contacts', dest='seed_contacts', type='int',
+            default=None,
+            help='Contacts in the synthetic graph (default: edges / 10)'),
+        make_option('--samples', dest='samples', type='int', default=20,
+            help='Number of random contacts to query (default: 20)'),
+        make_option('--hops', dest='hops', type='int', default=2),
+    )
+    
+    def handle_noargs(self, **options):
+        if options['seed_edges']:
+            self.seed(options['seed_edges'], options['seed_contacts'])
+        contact_ids = list(crm.ContactRelationship.objects.values_list(
+            'from_contact',
+            flat=True,
+        ).distinct())
+        if not contact_ids:
+            raise CommandError('There are no contact relationships to query')
+        samples = [
+            random.choice(contact_ids) for i in range(options['samples'])
+        ]
+        hops = options['hops']
+        
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            if graph.supports_recursive_queries():
+                self.time('within_hops (recursive query)', samples,
+                    lambda pk: graph.within_hops(pk, hops, recursive=True))
+            self.time('within_hops (batched levels)', samples,
+                lambda pk: graph.within_hops(pk, hops, recursive=False))
+            self.time('shortest_path', samples,
+                lambda pk: graph.shortest_path(pk, random.choice(contact_ids)))
+            self.time('connected_businesses', samples,
+                graph.connected_businesses)
+        finally:
+            settings.DEBUG = debug
+    
+    @transaction.commit_on_success
+    def seed(self, edges, contacts):
+        start = time.time()
+        if contacts is None:
+            contacts = max(edges / 10, 2)
+        people = synthetic.seed_contacts(contacts - contacts / 10)
+        businesses = synthetic.seed_contacts(contacts / 10, type='business')
+        count = synthetic.seed_relationships(people + businesses, edges)
+        print "Seeded %d contacts and %d relationship rows in %.1fs" % (
+            len(people) + len(businesses),
+            count,
+            time.time() - start,
+        )
+    
+    def time(self, label, samples, func):
+        timings = []
+        queries = 0
+        for pk in samples:
+            connection.queries = []
+            start = time.time()
+            func(pk)
+            timings.append(time.time() - start)
+            queries += len(connection.queries)
+        timings.sort()
+        print "%-32s mean %8.1f ms  max %8.1f ms  %5.1f queries" % (
+            label,
+            sum(timings) / len(timings) * 1000,
+            timings[-1] * 1000,
+            float(queries) / len(samples),
+        )
@@ -0,0 +1,111 @@
+import base64
+import cStringIO
+import time
+import xmlrpclib
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.test import Client
+
+from contactinfo import models as contactinfo
+
+
+class BasicAuthTransport(xmlrpclib.Transport):
+    """ Posts XML-RPC requests through the Django test client. """
+    
+    def __init__(self, username, password):
+        self._use_datetime = True
+        self.client = Client()
+        self.authorization = 'Basic %s' % base64.b64encode(
+            '%s:%s' % (username, password),
+        )
+    
+    def request(self, host, handler, request_body, verbose=0):
+        self.verbose = verbose
+        response = self.client.post(
+            handler,
+            request_body,
+            content_type='text/xml',
+            HTTP_AUTHORIZATION=self.authorization,
+        )
+        if response.status_code != 200:
+            raise CommandError('XML-RPC request failed with status %d' % (
+                response.status_code,
+            ))
+        return self.parse_response(cStringIO.StringIO(response.content))
+
+
+class Command(BaseCommand):
+    help = "Compare N single XML-RPC calls against one batched call"
+    option_list = BaseCommand.option_list + (
+        make_option('--username', dest='username',
+            help='User with the crm.access_xmlrpc permission'),
+        make_option('--password', dest='password'),
+        make_option('--count', dest='count', type='int', default=200,
+            help='Number of items to look up (default: 200)'),
+        make_option('--trac-env', dest='trac_env',
+            help='Trac environment used for project_relationships'),
+        make_option('--path', dest='path', default='/xml-rpc/',
+            help='Path of the XML-RPC service (default: /xml-rpc/)'),
+    )
+    
+    def handle(self, *args, **options):
+        if not options['username'] or not options['password']:
+            raise CommandError('--username and --password are required')
+        proxy = xmlrpclib.ServerProxy(
+            'http://testserver%s' % options['path'],
+            transport=BasicAuthTransport(
+                options['username'],
+                options['password'],
+            ),
+        )
+        count = options['count']
+        numbers = list(contactinfo.Phone.objects.values_list(
+            'number',
+            flat=True,
+        )[:count])
+        self.compare(
+            'callerid',
+            numbers,
+            lambda server, number: server.callerid(number),
+            lambda: proxy.callerid_batch(numbers),
+            proxy,
+        )
+        if options['trac_env']:
+            env = options['trac_env']
+            usernames = list(User.objects.values_list(
+                'username',
+                flat=True,
+            )[:count])
+            self.compare(
+                'project_relationships',
+                usernames,
+                lambda server, u: server.project_relationships(env, u),
+                lambda: proxy.project_relationships_batch(env, usernames),
+                proxy,
+            )
+    
+    def compare(self, name, items, call, batch_call, proxy):
+        print "%s (%d items)" % (name, len(items))
+        
+        start = time.time()
+        singles = [call(proxy, item) for item in items]
+        self.report('%d single calls' % len(items), start)
+        
+        start = time.time()
+        multicall = xmlrpclib.MultiCall(proxy)
+        for item in items:
+            call(multicall, item)
+        multi = list(multicall())
+        self.report('system.multicall', start)
+        
+        start = time.time()
+        batch = batch_call()
+        self.report('%s_batch' % name, start)
+        
+        if not singles == multi == batch:
+            raise CommandError('%s results differ between call styles' % name)
+    
+    def report(self, label, start):
+        print "    %-20s %8.1f ms" % (label, (time.time() - start) * 1000)
@@ -0,0 +1,157 @@
+import datetime
+import resource
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection, transaction
+from django.utils import simplejson as json
+
+from crm import models as crm
+from crm import synthetic
+from crm.endpoints import login_client, endpoints
+from crm.instrumentation import QueryCapture
+
+
+def percentile(values, percent):
+    """ Nearest-rank percentile of a sorted list """
+    if not values:
+        return None
+    index = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+def peak_memory():
+    """ Peak resident set size of this process, in kilobytes (Linux) """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(NoArgsCommand):
+    help = "Seed synthetic CRM data and time every page, lookup channel " \
+           "and XML-RPC method.  Seeded data is committed, so run it " \
+           "against a scratch database."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--people', dest='people', type='int', default=1000),
+        make_option('--businesses', dest='businesses', type='int',
+            default=100),
+        make_option('--relationships', dest='relationships', type='int',
+            default=2000, help='Person-to-person relationship rows'),
+        make_option('--interactions', dest='interactions', type='int',
+            default=5000),
+        make_option('--registrations', dest='registrations', type='int',
+            default=100),
+        make_option('--no-seed', dest='seed', action='store_false',
+            default=True, help='Benchmark the data already present'),
+        make_option('--iterations', dest='iterations', type='int',
+            default=20, help='Requests per endpoint (default: 20)'),
+        make_option('--username', dest='username',
+            help='User to request the pages as (default: first superuser)'),
+        make_option('--output', dest='output',
+            default='crm_benchmark.json',
+            help='JSON results file (default: crm_benchmark.json)'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if options['seed']:
+            start = time.time()
+            self.seed(options)
+            if verbosity > 0:
+                print "Seeded data in %.1f s" % (time.time() - start)
+        client = login_client(self.user(options['username']))
+        
+        results = {}
+        for name, func in endpoints(client):
+            # the first request warms caches and imports templates
+            func()
+            durations = []
+            queries = []
+            statuses = set()
+            memory_before = peak_memory()
+            for i in xrange(options['iterations']):
+                capture = QueryCapture().start()
+                start = time.time()
+                try:
+                    response = func()
+                finally:
+                    durations.append((time.time() - start) * 1000)
+                    capture.stop()
+                queries.append(capture.count)
+                status = getattr(response, 'status_code', None)
+                if status is not None:
+                    statuses.add(status)
+            durations.sort()
+            results[name] = {
+                'iterations': len(durations),
+                'statuses': sorted(statuses),
+                'min_ms': durations[0],
+                'p50_ms': percentile(durations, 50),
+                'p90_ms': percentile(durations, 90),
+                'p99_ms': percentile(durations, 99),
+                'max_ms': durations[-1],
+                'queries': max(queries),
+                'queries_min': min(queries),
+                'peak_memory_kb': peak_memory(),
+                'peak_memory_growth_kb': peak_memory() - memory_before,
+            }
+            if verbosity > 0:
+                print "%-40s p50 %8.1f ms  p90 %8.1f ms  p99 %8.1f ms  " \
+                      "%4d queries  %s" % (
+                    name,
+                    results[name]['p50_ms'],
+                    results[name]['p90_ms'],
+                    results[name]['p99_ms'],
+                    results[name]['queries'],
+                    ','.join([str(s) for s in sorted(statuses)]),
+                )
+        
+        output = open(options['output'], 'w')
+        try:
+            json.dump({
+                'date': datetime.datetime.now().isoformat(),
+                'database': connection.settings_dict['ENGINE'],
+                'iterations': options['iterations'],
+                'dataset': self.dataset(),
+                'endpoints': results,
+            }, output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+        if verbosity > 0:
+            print "Wrote %s" % options['output']
+    
+    def user(self, username):
+        if username:
+            users = User.objects.filter(username=username)
+        else:
+            users = User.objects.filter(is_superuser=True, is_active=True)
+        try:
+            return users.order_by('pk')[0]
+        except IndexError:
+            raise CommandError('No user to request the pages as; use --username')
+    
+    @transaction.commit_on_success
+    def seed(self, options):
+        people = synthetic.seed_contacts(options['people'], prefix='benchmark')
+        businesses = synthetic.seed_contacts(
+            options['businesses'],
+            type='business',
+            prefix='benchmark',
+        )
+        synthetic.seed_locations(people + businesses)
+        if people and businesses:
+            synthetic.seed_employees(businesses, people)
+        if len(people) > 1:
+            synthetic.seed_relationships(people, options['relationships'])
+        if people and options['interactions']:
+            synthetic.seed_interactions(people, options['interactions'])
+        synthetic.seed_registrations(people[:options['registrations']])
+    
+    def dataset(self):
+        return {
+            'people': crm.Contact.objects.filter(type='individual').count(),
+            'businesses': crm.Contact.objects.filter(type='business').count(),
+            'relationships': crm.ContactRelationship.objects.count(),
+            'interactions': crm.Interaction.objects.count(),
+            'registrations': crm.LoginRegistration.objects.count(),
+        }
@@ -0,0 +1,182 @@
+import re
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+
+from crm.endpoints import login_client, endpoints
+from crm.instrumentation import QueryCapture
+
+COST_RE = re.compile(r'cost=[\d.]+\.\.([\d.]+)')
+
+
+class Finding(object):
+    def __init__(self, endpoint, kind, detail, cost, sql):
+        self.endpoint = endpoint
+        self.kind = kind
+        self.detail = detail
+        self.cost = cost
+        self.sql = sql
+
+
+class Command(NoArgsCommand):
+    help = "Run EXPLAIN on the queries of every CRM view and report " \
+           "table scans, unindexed sorts and repeated queries"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--username', dest='username',
+            help='User to request the views as (default: first superuser)'),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Only show the most expensive LIMIT findings'),
+        make_option('--show-sql', dest='show_sql', action='store_true',
+            default=False, help='Print the SQL of each finding'),
+    )
+    
+    def handle_noargs(self, **options):
+        self.engine = connection.settings_dict['ENGINE'].split('.')[-1]
+        self.table_sizes = {}
+        client = self.client(options['username'])
+        findings = []
+        for endpoint, func in endpoints(client):
+            capture = QueryCapture().start()
+            try:
+                func()
+            finally:
+                capture.stop()
+            findings.extend(self.analyze(endpoint, capture.queries))
+        findings.sort(key=lambda f: f.cost, reverse=True)
+        if options['limit'] is not None:
+            findings = findings[:options['limit']]
+        for finding in findings:
+            print "%10.1f  %-28s %-20s %s" % (
+                finding.cost,
+                finding.endpoint,
+                finding.kind,
+                finding.detail,
+            )
+            if options['show_sql']:
+                print "            %s" % finding.sql
+        if not findings:
+            print "No problems found"
+    
+    def client(self, username):
+        if username:
+            users = User.objects.filter(username=username)
+        else:
+            users = User.objects.filter(is_superuser=True, is_active=True)
+        try:
+            user = users.order_by('pk')[0]
+        except IndexError:
+            raise CommandError('No user to run the views as; use --username')
+        return login_client(user)
+    
+    def analyze(self, endpoint, queries):
+        findings = []
+        seen = {}
+        for sql, params, duration in queries:
+            key = (sql, repr(params))
+            seen[key] = seen.get(key, 0) + 1
+        for (sql, params), count in seen.items():
+            if count > 1:
+                findings.append(Finding(
+                    endpoint,
+                    'duplicate query',
+                    'run %d times' % count,
+                    0.0,
+                    sql,
+                ))
+        templates = {}
+        for sql, params, duration in queries:
+            templates[sql] = templates.get(sql, 0) + 1
+        for sql, count in templates.items():
+            if count > 10:
+                findings.append(Finding(
+                    endpoint,
+                    'repeated statement',
+                    'run %d times with different parameters (N+1?)' % count,
+                    0.0,
+                    sql,
+                ))
+        explained = set()
+        for sql, params, duration in queries:
+            if params is None or not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            if sql in explained:
+                continue
+            explained.add(sql)
+            findings.extend(self.explain(endpoint, sql, params))
+        return findings
+    
+    def explain(self, endpoint, sql, params):
+        cursor = connection.cursor()
+        findings = []
+        if self.engine == 'sqlite3':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                words = detail.split()
+                if words[:1] == ['SCAN'] and 'INDEX' not in detail:
+                    # "SCAN TABLE foo" in older SQLite, "SCAN foo" in newer
+                    if words[1:2] == ['TABLE']:
+                        words = words[1:]
+                    findings.append(Finding(
+                        endpoint,
+                        'full table scan',
+                        detail,
+                        float(self.table_size(words[1])),
+                        sql,
+                    ))
+                elif 'TEMP B-TREE' in detail:
+                    findings.append(Finding(
+                        endpoint,
+                        'sort without index',
+                        detail,
+                        float(self.result_size(sql, params)),
+                        sql,
+                    ))
+        elif self.engine in ('postgresql', 'postgresql_psycopg2'):
+            cursor.execute('EXPLAIN ' + sql, params)
+            lines = [row[0] for row in cursor.fetchall()]
+            total = 0.0
+            match = lines and COST_RE.search(lines[0])
+            if match:
+                total = float(match.group(1))
+            for line in lines:
+                stripped = line.strip().lstrip('->').strip()
+                match = COST_RE.search(stripped)
+                cost = match and float(match.group(1)) or total
+                if stripped.startswith('Seq Scan'):
+                    findings.append(Finding(
+                        endpoint,
+                        'full table scan',
+                        stripped,
+                        cost,
+                        sql,
+                    ))
+                elif stripped.startswith('Sort '):
+                    findings.append(Finding(
+                        endpoint,
+                        'sort without index',
+                        stripped,
+                        cost,
+                        sql,
+                    ))
+        return findings
+    
+    def table_size(self, table):
+        """ SQLite has no cost estimates, so rank scans by table size """
+        if table not in self.table_sizes:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    'SELECT COUNT(*) FROM %s' % connection.ops.quote_name(table)
+                )
+                self.table_sizes[table] = cursor.fetchone()[0]
+            except Exception:
+                self.table_sizes[table] = 0
+        return self.table_sizes[table]
+    
+    def result_size(self, sql, params):
+        cursor = connection.cursor()
+        cursor.execute('SELECT COUNT(*) FROM (%s) AS audited' % sql, params)
+        return cursor.fetchone()[0]
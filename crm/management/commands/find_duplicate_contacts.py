@@ -0,0 +1,46 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from crm import models as crm
+from crm import duplicates
+
+
+class Command(NoArgsCommand):
+    help = "List likely duplicate contacts, best matches first"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threshold', dest='threshold', type='float',
+            default=duplicates.DEFAULT_THRESHOLD,
+            help='Minimum similarity score (default: %s)' % \
+                duplicates.DEFAULT_THRESHOLD),
+        make_option('--max-block-size', dest='max_block_size', type='int',
+            default=duplicates.DEFAULT_MAX_BLOCK_SIZE,
+            help='Skip blocking keys shared by more contacts than this '
+                 '(default: %s)' % duplicates.DEFAULT_MAX_BLOCK_SIZE),
+        make_option('--limit', dest='limit', type='int', default=None,
+            help='Only list the best LIMIT pairs'),
+    )
+    
+    def handle_noargs(self, **options):
+        start = time.time()
+        pairs = duplicates.find_duplicates(
+            threshold=options['threshold'],
+            max_block_size=options['max_block_size'],
+        )
+        if options['limit'] is not None:
+            pairs = pairs[:options['limit']]
+        names = {}
+        pks = set([pk for score, a, b in pairs for pk in (a, b)])
+        for contact in crm.Contact.objects.filter(pk__in=pks):
+            names[contact.pk] = unicode(contact)
+        for score, a, b in pairs:
+            print (u"%.3f\t%d\t%d\t%s\t%s" % (
+                score,
+                a,
+                b,
+                names.get(a, ''),
+                names.get(b, ''),
+            )).encode('utf-8')
+        if int(options.get('verbosity', 1)) > 1:
+            print "Found %d pairs in %.1fs" % (len(pairs), time.time() - start)
@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+
+from crm import models as crm
+from crm import thumbnails
+
+
+class Command(NoArgsCommand):
+    help = "Hash every contact picture and make its thumbnails, in a pool " \
+           "of worker processes"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', dest='processes', type='int',
+            default=None,
+            help='Number of worker processes (default: one per CPU)'),
+        make_option('--all', dest='all', action='store_true', default=False,
+            help='Also process pictures that are already hashed, e.g. '
+                 'after changing CRM_THUMBNAIL_SIZES'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        contacts = crm.Contact.objects.exclude(picture='').exclude(
+            picture__isnull=True,
+        )
+        if not options['all']:
+            contacts = contacts.filter(picture_hash='')
+        rows = list(contacts.values_list('pk', 'picture', 'picture_hash'))
+        # the workers only touch storage; don't let them inherit our
+        # database connection
+        connection.close()
+        pool = multiprocessing.Pool(options['processes'])
+        start = time.time()
+        processed = failed = 0
+        try:
+            # one picture per task, so a bad picture fails alone
+            results = pool.imap_unordered(thumbnails.process_picture, rows)
+            while True:
+                try:
+                    pk, name, hash = results.next()
+                except StopIteration:
+                    break
+                except Exception, e:
+                    failed += 1
+                    if verbosity > 0:
+                        print "Failed: %s" % e
+                    continue
+                # only if the picture hasn't changed in the meantime
+                crm.Contact.objects.filter(pk=pk, picture=name).update(
+                    picture_hash=hash,
+                )
+                processed += 1
+        finally:
+            pool.close()
+            pool.join()
+        if verbosity > 0:
+            print "Processed %d pictures (%d failed) in %.1f s" % (
+                processed,
+                failed,
+                time.time() - start,
+            )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import models as crm
+from crm import duplicates
+
+
+class Command(BaseCommand):
+    help = "Merge duplicate contacts into the first contact given"
+    args = '<keep_id> <duplicate_id> [duplicate_id ...]'
+    
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError('Usage: merge_contacts %s' % self.args)
+        try:
+            ids = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError('Contact ids must be integers')
+        contacts = crm.Contact.objects.in_bulk(ids)
+        missing = [str(pk) for pk in ids if pk not in contacts]
+        if missing:
+            raise CommandError('No contacts with ids %s' % ', '.join(missing))
+        keep = contacts[ids[0]]
+        try:
+            duplicates.merge_contacts(keep, [contacts[pk] for pk in ids[1:]])
+        except duplicates.MergeError, e:
+            raise CommandError(e)
+        print "Merged %d contacts into %s" % (len(ids) - 1, keep)
@@ -1,28 +1,146 @@
+import time
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.models import Count
 
+from contactinfo import models as contactinfo
+
 from crm import models as crm
 
+# locations per statement; repoint() binds three parameters for each, which
+# keeps it under SQLite's limit of 999
+CHUNK_SIZE = 300
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 
 class Command(NoArgsCommand):
     help = "Merge location data"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+            default=500,
+            help='Number of contacts merged per transaction (default: 500)'),
+        make_option('--dry-run', dest='dry_run', action='store_true',
+            default=False,
+            help='Report what would be merged without changing anything'),
+    )
     
-    @transaction.commit_on_success
+    @transaction.commit_manually
     def handle_noargs(self, **options):
-        contacts = crm.Contact.objects.annotate(
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        verbosity = int(options.get('verbosity', 1))
+        contact_ids = list(crm.Contact.objects.annotate(
             locs=Count('locations')
-        ).filter(locs__gt=1)
-        for contact in contacts:
-            print contact
-            locations = contact.locations.order_by('id')
-            primary = locations[0]
-            for location in locations[1:]:
-                print "Location %d" % location.id
-                for address in location.addresses.all():
-                    address.location = primary
-                    address.save()
-                for phone in location.phones.all():
-                    phone.location = primary
-                    phone.save()
-                location.delete()
+        ).filter(locs__gt=1).order_by('pk').values_list('pk', flat=True))
+        totals = {'contacts': 0, 'locations': 0, 'addresses': 0, 'phones': 0}
+        start = time.time()
+        try:
+            for i in range(0, len(contact_ids), batch_size):
+                counts = self.merge(contact_ids[i:i + batch_size], dry_run)
+                if dry_run:
+                    transaction.rollback()
+                else:
+                    transaction.commit()
+                for key, value in counts.iteritems():
+                    totals[key] += value
+                if verbosity > 1:
+                    print "%d/%d contacts, %.1f contacts/s" % (
+                        totals['contacts'],
+                        len(contact_ids),
+                        totals['contacts'] / max(time.time() - start, 0.001),
+                    )
+        except:
+            transaction.rollback()
+            raise
+        if dry_run:
+            verb = 'Would merge'
+        else:
+            verb = 'Merged'
+        print "%s %d locations with %d addresses and %d phones into " \
+            "the first location of %d contacts in %.1fs" % (
+            verb,
+            totals['locations'],
+            totals['addresses'],
+            totals['phones'],
+            totals['contacts'],
+            time.time() - start,
+        )
+    
+    def merge(self, contact_ids, dry_run):
+        """
+        Merges every location of the given contacts into their first (lowest
+        id) location and returns the number of rows affected.  Locations
+        that are shared with any other contact are left alone.
+        """
+        through = crm.Contact.locations.through
+        rows = through.objects.filter(
+            contact__in=contact_ids,
+        ).order_by('contact', 'location').values_list('contact', 'location')
+        primaries = {}
+        merged = {}
+        for contact_id, location_id in rows:
+            if contact_id in primaries:
+                merged[location_id] = primaries[contact_id]
+            else:
+                primaries[contact_id] = location_id
+        # a location linked to more than one contact, whether in this batch,
+        # a later one or not selected at all, would be taken from the others
+        for chunk in chunks(merged.keys()):
+            shared = through.objects.filter(
+                location__in=chunk,
+            ).values('location').annotate(
+                contacts=Count('contact'),
+            ).filter(contacts__gt=1)
+            for row in shared:
+                del merged[row['location']]
+        counts = {
+            'contacts': len(primaries),
+            'locations': len(merged),
+            'addresses': 0,
+            'phones': 0,
+        }
+        for chunk in chunks(merged.keys()):
+            if dry_run:
+                counts['addresses'] += contactinfo.Address.objects.filter(
+                    location__in=chunk,
+                ).count()
+                counts['phones'] += contactinfo.Phone.objects.filter(
+                    location__in=chunk,
+                ).count()
+                continue
+            targets = dict([(old, merged[old]) for old in chunk])
+            counts['addresses'] += self.repoint(contactinfo.Address, targets)
+            counts['phones'] += self.repoint(contactinfo.Phone, targets)
+            through.objects.filter(location__in=chunk).delete()
+            contactinfo.Location.objects.filter(pk__in=chunk).delete()
+        return counts
+    
+    def repoint(self, model, merged):
+        """
+        Moves the rows of model from each location in merged to the location
+        it maps to, in a single UPDATE.  Binds three parameters per location,
+        so merged should come from chunks().
+        """
+        qn = connection.ops.quote_name
+        column = qn(model._meta.get_field('location').column)
+        params = []
+        for old, new in merged.iteritems():
+            params.extend([old, new])
+        params.extend(merged.keys())
+        sql = "UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % (
+            qn(model._meta.db_table),
+            column,
+            column,
+            ' '.join(['WHEN %s THEN %s'] * len(merged)),
+            column,
+            ', '.join(['%s'] * len(merged)),
+        )
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return cursor.rowcount
@@ -2,6 +2,7 @@ import random
 import datetime
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.utils.hashcompat import sha_constructor
 from django.db import transaction
@@ -10,6 +11,42 @@ from django.contrib.auth.models import User
 from django.template.loader import render_to_string
 from django.core.mail import send_mail
 
+from crm import caching
+
+# seconds a cached copy of a reference table is trusted; bounds how long a
+# copy reloaded between a write and its commit can outlive the write
+DEFAULT_REFERENCE_DATA_TIMEOUT = 60 * 5
+
+
+class ReferenceDataManager(models.Manager):
+    """
+    Manager for small tables that rarely change.  cached() loads the whole
+    table into the shared cache, keyed on the table's cache generation.
+    Saving or deleting a row bumps the generation (see crm.models); the
+    bump happens before the write commits, so copies also expire after
+    CRM_REFERENCE_DATA_TIMEOUT seconds.
+    """
+    
+    def cached(self):
+        table = self.model._meta.db_table
+        key = caching.make_key(
+            'reference-data',
+            table,
+            caching.get_generation(table),
+        )
+        rows = cache.get(key)
+        if rows is None:
+            rows = list(self.get_query_set())
+            cache.set(key, rows, getattr(
+                settings,
+                'CRM_REFERENCE_DATA_TIMEOUT',
+                DEFAULT_REFERENCE_DATA_TIMEOUT,
+            ))
+        return rows
+    
+    def choices(self):
+        return [(obj.pk, unicode(obj)) for obj in self.cached()]
+
 
 class RegistrationManager(models.Manager):
     def create_pending_login(self, contact):
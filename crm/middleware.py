@@ -16,11 +16,8 @@
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from crm import models as crm
-
-try:
-    from timepiece import models as timepiece
-except ImportError:
-    timepiece = None
+from crm import routers
+from crm.integrations import timepiece
 
 class StandardViewKwargsMiddleware(object):
     """
@@ -66,3 +63,25 @@ class StandardViewKwargsMiddleware(object):
                     **args
                 )
             view_kwargs['project'] = request.project
+
+
+class ReplicaMiddleware(object):
+    """
+    Keeps a browser on the primary database for a few seconds after it
+    wrote something, so the replica's lag never hides the user's own
+    changes.  See crm.routers.
+    """
+    
+    def process_request(self, request):
+        routers.reset()
+        routers.pin_to_primary(routers.PIN_COOKIE in request.COOKIES)
+    
+    def process_response(self, request, response):
+        if routers.has_written():
+            response.set_cookie(
+                routers.PIN_COOKIE,
+                '1',
+                max_age=routers.sticky_seconds(),
+            )
+        routers.reset()
+        return response
@@ -0,0 +1,11 @@
+BEGIN;
+CREATE TABLE IF NOT EXISTS "crm_contacthistory" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "contact_id" integer NOT NULL REFERENCES "crm_contact" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "changed_by_id" integer REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "date" timestamp with time zone NOT NULL,
+    "changes" text NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "crm_contacthistory_contact_id_date" ON "crm_contacthistory" ("contact_id", "date");
+CREATE INDEX IF NOT EXISTS "crm_contacthistory_changed_by_id" ON "crm_contacthistory" ("changed_by_id");
+COMMIT;
@@ -0,0 +1,8 @@
+-- run ./manage.py backfill_contact_emails afterwards to fill in the new column
+BEGIN;
+ALTER TABLE crm_contact ADD COLUMN "email_normalized" varchar(75) NOT NULL DEFAULT '';
+ALTER TABLE crm_contact ALTER COLUMN "email_normalized" DROP DEFAULT;
+CREATE INDEX IF NOT EXISTS "crm_contact_email_normalized" ON "crm_contact" ("email_normalized");
+-- backs case-insensitive (iexact) lookups of user e-mail addresses
+CREATE INDEX IF NOT EXISTS "auth_user_email_upper" ON "auth_user" (UPPER("email"));
+COMMIT;
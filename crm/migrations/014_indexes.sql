@@ -0,0 +1,10 @@
+-- indexes for the CRM's hot query paths, see crm/indexes.py; IF NOT EXISTS
+-- (PostgreSQL 9.5+) skips those syncdb already created
+BEGIN;
+CREATE INDEX IF NOT EXISTS "crm_contact_type_sort_name" ON "crm_contact" ("type", "sort_name");
+CREATE INDEX IF NOT EXISTS "crm_contact_external_id" ON "crm_contact" ("external_id");
+CREATE INDEX IF NOT EXISTS "crm_interaction_completed_date" ON "crm_interaction" ("completed", "date");
+CREATE INDEX IF NOT EXISTS "crm_interaction_date" ON "crm_interaction" ("date");
+CREATE INDEX IF NOT EXISTS "crm_loginregistration_activation_key" ON "crm_loginregistration" ("activation_key");
+CREATE INDEX IF NOT EXISTS "crm_contactrelationship_dates" ON "crm_contactrelationship" ("start_date", "end_date");
+COMMIT;
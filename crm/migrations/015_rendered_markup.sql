@@ -0,0 +1,9 @@
+-- run ./manage.py backfill_rendered_markup afterwards to fill in the new columns
+BEGIN;
+ALTER TABLE crm_contact ADD COLUMN "description_html" text NOT NULL DEFAULT '';
+ALTER TABLE crm_contact ALTER COLUMN "description_html" DROP DEFAULT;
+ALTER TABLE crm_contact ADD COLUMN "notes_html" text NOT NULL DEFAULT '';
+ALTER TABLE crm_contact ALTER COLUMN "notes_html" DROP DEFAULT;
+ALTER TABLE crm_interaction ADD COLUMN "memo_html" text NOT NULL DEFAULT '';
+ALTER TABLE crm_interaction ALTER COLUMN "memo_html" DROP DEFAULT;
+COMMIT;
@@ -0,0 +1,5 @@
+-- run ./manage.py generate_thumbnails afterwards to hash existing pictures
+BEGIN;
+ALTER TABLE crm_contact ADD COLUMN "picture_hash" varchar(40) NOT NULL DEFAULT '';
+ALTER TABLE crm_contact ALTER COLUMN "picture_hash" DROP DEFAULT;
+COMMIT;
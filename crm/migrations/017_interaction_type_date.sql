@@ -0,0 +1,4 @@
+-- backs the interaction admin's type filter, see crm/indexes.py
+BEGIN;
+CREATE INDEX IF NOT EXISTS "crm_interaction_type_date" ON "crm_interaction" ("type", "date");
+COMMIT;
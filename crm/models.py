@@ -13,8 +13,10 @@
 #    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
 #
 import datetime
+import re
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import signals
 from django.contrib.auth.models import User, Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
@@ -25,8 +27,15 @@ from django.utils.functional import curry
 from django.template.loader import render_to_string
 from django.template.defaultfilters import slugify
 from django.core.mail import send_mail
+from django.utils import simplejson as json
 
 from crm import managers as crm_managers
+from crm import caching
+from crm import integrations
+from crm import notifications
+from crm import permissions
+from crm import rendering
+from crm import thumbnails
 
 from contactinfo import models as contactinfo
 
@@ -37,6 +46,42 @@ CONTACT_TYPES = (
     ('business', 'Business'),
 )
 
+def normalize_email(email):
+    """
+    Returns the form of an e-mail address used to compare addresses.
+    """
+    return (email or '').strip().lower()
+
+
+# room for a numeric suffix within auth_user.username's 30 characters
+USERNAME_BASE_LENGTH = 24
+
+
+def allocate_username(s):
+    """
+    Returns an unused username based on 's': its slug, or the slug followed
+    by one more than the highest number already used after it.
+    
+    Unlike slugify_uniquely, which loads every username starting with the
+    slug, this reads a single row however many users share the name.
+    """
+    base = slugify(s)[:USERNAME_BASE_LENGTH] or 'user'
+    taken = User.objects.filter(
+        username__startswith=base,
+        username__regex=r'^%s([1-9][0-9]*)?$' % re.escape(base),
+    ).extra(
+        select={'username_length': 'LENGTH(username)'},
+    ).order_by('-username_length', '-username').values_list(
+        'username',
+        'username_length',
+    )[:1]
+    if not taken:
+        return base
+    username, length = taken[0]
+    suffix = username[len(base):]
+    return '%s%d' % (base, int(suffix or 0) + 1)
+
+
 def slugify_uniquely(s, queryset=None, field='slug'):
     """
     Returns a slug based on 's' that is unique for all instances of the given
@@ -88,9 +133,19 @@ class Contact(models.Model):
     sort_name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True)
     email = models.EmailField(blank=True)
+    # kept in sync with email by save() for indexed, case-insensitive lookups
+    email_normalized = models.CharField(
+        max_length=75,
+        blank=True,
+        editable=False,
+        db_index=True,
+    )
     description = models.TextField(blank=True)
+    description_html = models.TextField(blank=True, editable=False)
     notes = models.TextField(blank=True)
+    notes_html = models.TextField(blank=True, editable=False)
     picture = models.ImageField(null=True, blank=True, max_length=1048576, upload_to="picture/profile/")
+    picture_hash = models.CharField(max_length=40, blank=True, editable=False)
     external_id = models.CharField(max_length=32, blank=True)
     
     objects = models.Manager()
@@ -107,20 +162,11 @@ class Contact(models.Model):
             )
     
     def is_editable_by(self, user):
-        has_membership = False
-        try:
-            from members.models import Membership
-            has_membership = (
-                Membership.objects.filter(contact=self).count() > 0
-                and self.user == user
-            )
-        except ImportError:
-            pass
-        has_perms = user.has_perms((
-            'crm.add_contact',
-            'crm.change_contact',
-        ))
-        return (has_membership or has_perms)
+        """
+        Users with the add and change contact permissions can edit any
+        contact; members can edit their own.
+        """
+        return permissions.for_user(user).can_edit(self)
     
     def _get_TYPE_relations(self, contact_type):
         return self.contacts.filter(type=contact_type)
@@ -129,15 +175,28 @@ class Contact(models.Model):
         super(Contact, self).__init__(*args, **kwargs)
         self.add_accessor_methods()
     
+    def save(self, *args, **kwargs):
+        self.email_normalized = normalize_email(self.email)
+        rendering.render_fields(self)
+        if not self.picture:
+            self.picture_hash = ''
+        elif not self.picture._committed:
+            # a new upload, still in memory or a temporary file
+            self.picture_hash = thumbnails.content_hash(self.picture.file)
+        elif not self.picture_hash:
+            # uploaded before pictures were hashed
+            try:
+                self.picture_hash = thumbnails.picture_hash(self.picture.name)
+            except (IOError, OSError):
+                pass
+        super(Contact, self).save(*args, **kwargs)
+    
     def _get_exchange_types(self):
-        # import here to avoid circular import
-        try:
-            from minibooks.ledger.models import ExchangeType
-            return ExchangeType.objects.filter(
+        if integrations.ledger:
+            return integrations.ledger.ExchangeType.objects.filter(
                 business_types__businesses=self
             )
-        except ImportError:
-            return []
+        return []
     exchange_types = property(_get_exchange_types)
     
     def primary_phone(self):
@@ -225,6 +284,8 @@ class BusinessType(models.Model):
         help_text='Allow billable expenses to projects not associated with a business of this type.  For example, a billable expense for staying at a hotel, but will be billed to a client project.  When creating an exchange, this value specifies whether or not all projects show up under the Project drop down menu.'
     )
     
+    objects = crm_managers.ReferenceDataManager()
+    
     def __unicode__(self):
         return self.name
 
@@ -233,6 +294,8 @@ class RelationshipType(models.Model):
     name = models.CharField(max_length=255, unique=True)
     slug = models.CharField(max_length=255, unique=True, editable=False)
     
+    objects = crm_managers.ReferenceDataManager()
+    
     def save(self):
         queryset = RelationshipType.objects.all()
         if self.id:
@@ -259,6 +322,7 @@ class Interaction(models.Model):
     type = models.CharField(max_length=15, choices=INTERACTION_TYPES)
     completed = models.BooleanField(default=False)
     memo = models.TextField(blank=True)
+    memo_html = models.TextField(blank=True, editable=False)
     cdr_id = models.TextField(null=True)
     
     contacts = models.ManyToManyField(Contact, related_name='interactions')
@@ -279,6 +343,10 @@ class Interaction(models.Model):
             return "%.2f minutes" % time
     duration.short_description = 'Duration'
     
+    def save(self, *args, **kwargs):
+        rendering.render_fields(self)
+        super(Interaction, self).save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-date']
         permissions = (
@@ -290,6 +358,31 @@ class Interaction(models.Model):
         return "%s: %s" % ( self.date.strftime("%m/%d/%y"), self.type )
 
 
+class ContactHistory(models.Model):
+    """ Field-level changes made to a contact's profile """
+    
+    contact = models.ForeignKey(Contact, related_name='history')
+    changed_by = models.ForeignKey(User, null=True, blank=True)
+    date = models.DateTimeField(default=datetime.datetime.now)
+    changes = models.TextField()
+    
+    def get_changes(self):
+        return json.loads(self.changes)
+    
+    def set_changes(self, changes):
+        self.changes = json.dumps(changes, separators=(',', ':'))
+    
+    class Meta:
+        ordering = ['-date', '-id']
+        verbose_name_plural = 'contact histories'
+    
+    def __unicode__(self):
+        return "Change to %s on %s" % (
+            self.contact,
+            self.date.strftime("%m/%d/%y"),
+        )
+
+
 class LoginRegistration(models.Model):
     contact = models.ForeignKey(Contact)
     date = models.DateTimeField()
@@ -300,25 +393,49 @@ class LoginRegistration(models.Model):
     objects = crm_managers.RegistrationManager()
     
     def activate(self, password):
-        username = slugify_uniquely(
-            self.contact.get_full_name(),
-            User.objects.all(),
-            'username',
-        )
-        user = User.objects.create_user(
-            username,
-            self.contact.email,
-            password,
+        """
+        Creates the contact's user and marks the registration activated,
+        with one INSERT and two guarded UPDATEs (plus the group memberships)
+        in a single transaction.
+        
+        Returns the new user, or None if the contact got a user in the
+        meantime.
+        """
+        contact = self.contact
+        now = datetime.datetime.now()
+        email = contact.email.strip()
+        if '@' in email:
+            # lowercase the domain, like UserManager.create_user
+            name, domain = email.split('@', 1)
+            email = '@'.join([name, domain.lower()])
+        user = User(
+            username=allocate_username(contact.get_full_name()),
+            email=email,
+            first_name=contact.first_name,
+            last_name=contact.last_name,
+            is_active=True,
+            last_login=now,
+            date_joined=now,
         )
-        user.first_name = self.contact.first_name
-        user.last_name = self.contact.last_name
-        user.is_active = True
+        user.set_password(password)
         user.save()
-        self.contact.user = user
-        self.contact.save()
+        # save() would rewrite (and re-render) the whole contact row
+        updated = Contact.objects.filter(
+            pk=contact.pk,
+            user__isnull=True,
+        ).update(user=user)
+        if not updated:
+            user.delete()
+            return None
+        caching.bump_generation('contacts')
+        contact.user = user
+        LoginRegistration.objects.filter(pk=self.pk).update(activated=True)
         self.activated = True
-        self.save()
-        return self.contact.user
+        group_ids = self.groups.values_list('pk', flat=True)
+        if group_ids:
+            user.groups.add(*group_ids)
+        return user
+    activate = transaction.commit_on_success(activate)
     
     def prepare_email(self, send=True):
         expiration = getattr(
@@ -387,3 +504,163 @@ def install():
     if created:
         for perm in Permission.objects.filter(codename__icontains='pagelet'):
             group.permissions.add(perm)
+
+
+# Cache invalidation.  The 'contacts' generation covers the username/e-mail
+# to contact mapping and the 'project_relationships' generation covers
+# anything that can change which relationship types a contact has on a
+# project.  timepiece is optional and imports this module, so its models
+# are connected by name as they are prepared rather than imported.
+
+RELATIONSHIP_MODELS = (
+    ('crm', 'relationshiptype'),
+    ('timepiece', 'project'),
+    ('timepiece', 'projectrelationship'),
+)
+
+
+def _relationship_saved(sender, **kwargs):
+    caching.bump_generation('project_relationships')
+
+
+def _connect_relationship_model(model):
+    uid = model._meta.db_table
+    signals.post_save.connect(
+        _relationship_saved,
+        sender=model,
+        dispatch_uid='crm-relationship-saved-%s' % uid,
+    )
+    signals.post_delete.connect(
+        _relationship_saved,
+        sender=model,
+        dispatch_uid='crm-relationship-deleted-%s' % uid,
+    )
+    for field in model._meta.local_many_to_many:
+        through = field.rel.through
+        # explicit through models are relationship models themselves
+        if isinstance(through, type) and through._meta.auto_created:
+            signals.m2m_changed.connect(
+                _relationship_saved,
+                sender=through,
+                dispatch_uid='crm-relationship-types-changed-%s' % (
+                    through._meta.db_table,
+                ),
+            )
+
+
+def _relationship_model_prepared(sender, **kwargs):
+    opts = sender._meta
+    if (opts.app_label, opts.object_name.lower()) in RELATIONSHIP_MODELS:
+        _connect_relationship_model(sender)
+signals.class_prepared.connect(
+    _relationship_model_prepared,
+    dispatch_uid='crm-relationship-model-prepared',
+)
+for _app_label, _name in RELATIONSHIP_MODELS:
+    # models prepared before this module finished loading
+    _model = models.get_model(_app_label, _name, seed_cache=False)
+    if _model is not None:
+        _connect_relationship_model(_model)
+
+
+def _reference_data_changed(sender, **kwargs):
+    caching.bump_generation(sender._meta.db_table)
+for _model in (BusinessType, RelationshipType):
+    signals.post_save.connect(
+        _reference_data_changed,
+        sender=_model,
+        dispatch_uid='crm-reference-saved-%s' % _model._meta.db_table,
+    )
+    signals.post_delete.connect(
+        _reference_data_changed,
+        sender=_model,
+        dispatch_uid='crm-reference-deleted-%s' % _model._meta.db_table,
+    )
+
+
+def _remember_user_identity(sender, instance, **kwargs):
+    instance._crm_identity = (instance.username, instance.email)
+signals.post_init.connect(
+    _remember_user_identity,
+    sender=User,
+    dispatch_uid='crm-user-init',
+)
+
+
+def _user_saved(sender, instance, created, **kwargs):
+    identity = (instance.username, instance.email)
+    previous = getattr(instance, '_crm_identity', None)
+    if identity != previous:
+        caching.bump_generation('contacts')
+    # new users belong to no groups yet
+    if not created and previous and instance.email != previous[1]:
+        notifications.invalidate()
+    instance._crm_identity = identity
+signals.post_save.connect(_user_saved, sender=User, dispatch_uid='crm-user-saved')
+
+
+def _notification_groups_changed(sender, **kwargs):
+    notifications.invalidate()
+signals.m2m_changed.connect(
+    _notification_groups_changed,
+    sender=User.groups.through,
+    dispatch_uid='crm-user-groups-changed',
+)
+signals.post_delete.connect(
+    _notification_groups_changed,
+    sender=User,
+    dispatch_uid='crm-notification-user-deleted',
+)
+# renamed or deleted groups
+signals.post_save.connect(
+    _notification_groups_changed,
+    sender=Group,
+    dispatch_uid='crm-notification-group-saved',
+)
+signals.post_delete.connect(
+    _notification_groups_changed,
+    sender=Group,
+    dispatch_uid='crm-notification-group-deleted',
+)
+
+
+def _contact_identity(contact):
+    return (contact.user_id, contact.email_normalized)
+
+
+def _remember_contact_identity(sender, instance, **kwargs):
+    instance._crm_identity = _contact_identity(instance)
+signals.post_init.connect(
+    _remember_contact_identity,
+    sender=Contact,
+    dispatch_uid='crm-contact-init',
+)
+
+
+def _contact_saved(sender, instance, created, **kwargs):
+    identity = _contact_identity(instance)
+    previous = getattr(instance, '_crm_identity', None) or (None, '')
+    # only contacts with a user appear in the mapping
+    has_user = instance.user_id or previous[0]
+    if has_user and (created or identity != previous):
+        caching.bump_generation('contacts')
+    instance._crm_identity = identity
+signals.post_save.connect(
+    _contact_saved,
+    sender=Contact,
+    dispatch_uid='crm-contact-saved',
+)
+
+
+def _identity_deleted(sender, instance, **kwargs):
+    caching.bump_generation('contacts')
+signals.post_delete.connect(
+    _identity_deleted,
+    sender=User,
+    dispatch_uid='crm-user-deleted',
+)
+signals.post_delete.connect(
+    _identity_deleted,
+    sender=Contact,
+    dispatch_uid='crm-contact-deleted',
+)
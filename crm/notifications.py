@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Who gets e-mailed about which changes.
+
+CRM_NOTIFICATION_GROUPS maps each kind of change to the names of the groups
+whose members are told about it:
+
+CRM_NOTIFICATION_GROUPS = {
+    'contact_changed': ('Contact Notifications', 'Account Managers'),
+}
+
+Recipient lists are cached until a group's membership or a user's e-mail
+address changes (see the signal handlers in crm.models), and for at most
+RECIPIENTS_TIMEOUT seconds, or CRM_LOCAL_CACHE_SECONDS when the cache
+isn't shared between processes (see crm.caching).
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from crm import caching
+
+DEFAULT_NOTIFICATION_GROUPS = {
+    'contact_changed': ('Contact Notifications',),
+}
+GENERATION = 'notification_groups'
+RECIPIENTS_TIMEOUT = 60 * 10
+
+
+def notification_groups(change_type):
+    groups = getattr(
+        settings,
+        'CRM_NOTIFICATION_GROUPS',
+        DEFAULT_NOTIFICATION_GROUPS,
+    )
+    return tuple(groups.get(change_type, ()))
+
+
+def _query_recipients(group_names):
+    emails = User.objects.filter(
+        groups__name__in=group_names,
+    ).exclude(email='').values_list('email', flat=True).distinct()
+    return sorted(emails)
+
+
+def recipients(change_type):
+    """
+    Returns the e-mail addresses of the members of the groups notified of
+    the given kind of change.
+    """
+    group_names = notification_groups(change_type)
+    if not group_names:
+        return []
+    key = caching.make_key(
+        'notification-recipients',
+        caching.get_generation(GENERATION),
+        *sorted(group_names)
+    )
+    emails = cache.get(key)
+    if emails is None:
+        emails = _query_recipients(group_names)
+        cache.set(key, emails, caching.timeout(RECIPIENTS_TIMEOUT))
+    return emails
+
+
+def invalidate():
+    caching.bump_generation(GENERATION)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#
+#    You should have received a copy of the BSD License along with django-crm.
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+A Paginator that reads the size of an unfiltered queryset from the
+database's table statistics instead of running SELECT COUNT(*).
+
+Counting every row of a large table is a full scan on PostgreSQL and
+InnoDB.  Once the estimate passes CRM_ESTIMATED_COUNT_THRESHOLD rows
+(100000 by default, None disables estimates) the estimate is used as the
+count; smaller tables and filtered querysets are still counted exactly.
+"""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+
+DEFAULT_THRESHOLD = 100000
+
+
+def threshold():
+    return getattr(settings, 'CRM_ESTIMATED_COUNT_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def estimate_rows(model, using='default'):
+    """
+    Returns the database's estimate of the number of rows in model's
+    table, or None if the backend keeps no usable estimate.
+    """
+    connection = connections[using]
+    engine = connection.settings_dict['ENGINE'].split('.')[-1]
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if engine in ('postgresql', 'postgresql_psycopg2'):
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            [table],
+        )
+        row = cursor.fetchone()
+    elif engine == 'mysql':
+        cursor.execute('SHOW TABLE STATUS LIKE %s', [table])
+        row = cursor.fetchone()
+        row = row and (row[4],)
+    elif engine == 'sqlite3':
+        # SQLite keeps no row estimate; the highest primary key is an
+        # index lookup and an upper bound while rows are rarely deleted
+        cursor.execute('SELECT MAX(%s) FROM %s' % (
+            connection.ops.quote_name(model._meta.pk.column),
+            connection.ops.quote_name(table),
+        ))
+        row = cursor.fetchone()
+    else:
+        row = None
+    if row and row[0] is not None:
+        return int(row[0])
+    return None
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.extra and not query.distinct
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginates a queryset, using the table estimate as its count when the
+    queryset covers the whole of a large table.
+    """
+
+    estimated = False
+
+    def _get_count(self):
+        if self._count is None:
+            limit = threshold()
+            if limit is not None and is_unfiltered(self.object_list):
+                estimate = estimate_rows(
+                    self.object_list.model,
+                    self.object_list.db,
+                )
+                if estimate is not None and estimate > limit:
+                    self._count = estimate
+                    self.estimated = True
+            if self._count is None:
+                self._count = self.object_list.count()
+        return self._count
+    count = property(_get_count)
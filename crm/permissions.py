@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Permission checks answered from memory.
+
+The first check for a user loads their permission names and the ids of
+their contacts with a membership; later checks on the same User instance
+(request.user lives for one request) run no queries.
+"""
+
+from crm import integrations
+
+
+class UserPermissions(object):
+    def __init__(self, user):
+        self.user = user
+        self._perms = None
+        self._membership_contact_ids = None
+    
+    def _get_perms(self):
+        if self._perms is None:
+            if self.user.is_active and self.user.is_authenticated():
+                self._perms = self.user.get_all_permissions()
+            else:
+                self._perms = set()
+        return self._perms
+    perms = property(_get_perms)
+    
+    def has_perm(self, perm):
+        if not self.user.is_active:
+            return False
+        if self.user.is_superuser:
+            return True
+        return perm in self.perms
+    
+    def has_perms(self, perms):
+        for perm in perms:
+            if not self.has_perm(perm):
+                return False
+        return True
+    
+    def _get_membership_contact_ids(self):
+        if self._membership_contact_ids is None:
+            if integrations.members and self.user.is_authenticated():
+                self._membership_contact_ids = set(
+                    integrations.members.Membership.objects.filter(
+                        contact__user=self.user,
+                    ).values_list('contact', flat=True)
+                )
+            else:
+                self._membership_contact_ids = set()
+        return self._membership_contact_ids
+    membership_contact_ids = property(_get_membership_contact_ids)
+    
+    def can_edit(self, contact):
+        """ See Contact.is_editable_by """
+        if self.has_perms(('crm.add_contact', 'crm.change_contact')):
+            return True
+        return (
+            contact.user_id is not None and
+            contact.user_id == self.user.id and
+            contact.pk in self.membership_contact_ids
+        )
+
+
+def for_user(user):
+    """
+    Returns the UserPermissions of the given user, kept on the user instance
+    alongside the auth backend's own permission cache.
+    """
+    if not hasattr(user, '_crm_permissions'):
+        user._crm_permissions = UserPermissions(user)
+    return user._crm_permissions
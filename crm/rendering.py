@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Markup fields stored alongside their rendered HTML.
+
+Each field listed in RENDERED_FIELDS has a <field>_html column that is
+rendered when the instance is saved, so templates don't run markdown or
+textile on every request.
+"""
+
+from django.contrib.markup.templatetags import markup
+from django.utils.safestring import mark_safe
+
+# model name -> ((source field, markup language), ...)
+RENDERED_FIELDS = {
+    'contact': (('description', 'textile'), ('notes', 'textile')),
+    'interaction': (('memo', 'markdown'),),
+}
+
+RENDERERS = {
+    'markdown': markup.markdown,
+    'textile': markup.textile,
+}
+
+
+def render(source, language):
+    if not source:
+        return u''
+    return RENDERERS[language](source)
+
+
+def rendered_fields(model):
+    return RENDERED_FIELDS.get(model._meta.object_name.lower(), ())
+
+
+def render_fields(instance):
+    """ Renders every markup field of instance into its _html attribute """
+    for field, language in rendered_fields(instance):
+        setattr(
+            instance,
+            '%s_html' % field,
+            render(getattr(instance, field), language),
+        )
+
+
+def get_rendered(instance, field):
+    """
+    Returns the stored HTML for the given field, rendering it on the fly for
+    rows saved before the HTML was stored (see backfill_rendered_markup).
+    """
+    source = getattr(instance, field)
+    html = getattr(instance, '%s_html' % field, None)
+    if source and not html:
+        for name, language in rendered_fields(instance):
+            if name == field:
+                html = render(source, language)
+    return mark_safe(html or u'')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Sends the reads of read-only CRM paths to a replica database.
+
+To enable it, add the replica to DATABASES and set:
+
+DATABASE_ROUTERS = ['crm.routers.ReplicaRouter']
+CRM_REPLICA_DATABASE = 'replica'
+
+and add crm.middleware.ReplicaMiddleware to MIDDLEWARE_CLASSES.  Only code
+wrapped with use_replica reads from the replica, and never inside a managed
+transaction (e.g. commit_on_success) or once the current request has
+written anything.  After a write the middleware keeps that browser on the
+primary for CRM_REPLICA_STICKY_SECONDS (10 by default) so users see their
+own changes.
+"""
+
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+DEFAULT_STICKY_SECONDS = 10
+PIN_COOKIE = 'crm_primary'
+
+# per-thread (so per-request) routing state
+_state = threading.local()
+
+# written on every request by the session middleware; not a user's write
+IGNORED_WRITES = ('sessions',)
+
+
+def replica_alias():
+    alias = getattr(settings, 'CRM_REPLICA_DATABASE', None)
+    if alias and alias in connections.databases:
+        return alias
+    return None
+
+
+def sticky_seconds():
+    return getattr(
+        settings,
+        'CRM_REPLICA_STICKY_SECONDS',
+        DEFAULT_STICKY_SECONDS,
+    )
+
+
+def use_replica(func):
+    """
+    Lets the reads made by func (a view or any other function) go to the
+    replica.
+    """
+    def wrapper(*args, **kwargs):
+        previous = getattr(_state, 'replica', False)
+        _state.replica = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _state.replica = previous
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def pin_to_primary(pinned=True):
+    _state.pinned = pinned
+
+
+def reset():
+    _state.pinned = False
+    _state.wrote = False
+
+
+def has_written():
+    return getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter(object):
+    def _reading_replica(self):
+        return (
+            getattr(_state, 'replica', False) and
+            not getattr(_state, 'pinned', False) and
+            not transaction.is_managed(using=DEFAULT_DB_ALIAS)
+        )
+    
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if alias is None:
+            return None
+        if self._reading_replica():
+            return alias
+        # be explicit, or objects loaded from the replica would route their
+        # related lookups back to it
+        return DEFAULT_DB_ALIAS
+    
+    def db_for_write(self, model, **hints):
+        alias = replica_alias()
+        if alias is None:
+            return None
+        if model._meta.app_label not in IGNORED_WRITES:
+            # read your own writes for the rest of this request
+            _state.pinned = True
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        alias = replica_alias()
+        if alias is None:
+            return None
+        dbs = (DEFAULT_DB_ALIAS, alias)
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+    
+    def allow_syncdb(self, db, model):
+        return None
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Contact selections kept in the session and referenced by a token, so that
+admin actions can hand thousands of contacts to a view without putting
+their ids in a URL.
+
+A selection is either a list of ids or, for "select all" in the admin, the
+query behind the filtered change list, which is never evaluated into ids.
+"""
+
+import uuid
+
+from crm import models as crm
+
+SESSION_KEY = 'crm_selections'
+CHUNK_SIZE = 500
+
+
+def store_selection(request, ids=None, queryset=None):
+    """
+    Saves the given contact ids or queryset in the session and returns the
+    token that refers to it.
+    """
+    token = uuid.uuid4().hex
+    if queryset is not None:
+        selection = {'query': queryset.query}
+    else:
+        selection = {'ids': [int(pk) for pk in ids]}
+    selections = request.session.get(SESSION_KEY, {})
+    selections[token] = selection
+    request.session[SESSION_KEY] = selections
+    return token
+
+
+class Selection(object):
+    """
+    A set of contacts given either by ids or by a query.
+    """
+    
+    def __init__(self, ids=None, query=None):
+        self.ids = ids
+        self.query = query
+    
+    def _queryset(self):
+        queryset = crm.Contact.objects.all()
+        queryset.query = self.query
+        return queryset
+    
+    def count(self):
+        if self.query is not None:
+            return self._queryset().count()
+        return len(self.ids)
+    
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields lists of at most chunk_size contacts, in id order, with one
+        small query per chunk.
+        """
+        if self.query is None:
+            ids = sorted(set(self.ids))
+            for i in range(0, len(ids), chunk_size):
+                yield list(crm.Contact.objects.filter(
+                    pk__in=ids[i:i + chunk_size],
+                ).order_by('pk'))
+            return
+        queryset = self._queryset()
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(
+                pk__gt=last_pk,
+            ).order_by('pk')[:chunk_size])
+            if not chunk:
+                break
+            yield chunk
+            last_pk = chunk[-1].pk
+
+
+def get_selection(request, token):
+    """
+    Returns the Selection stored under token, or None if there is none.
+    """
+    selection = request.session.get(SESSION_KEY, {}).get(token)
+    if selection is None:
+        return None
+    return Selection(**selection)
+
+
+def discard_selection(request, token):
+    selections = request.session.get(SESSION_KEY, {})
+    if token in selections:
+        del selections[token]
+        request.session[SESSION_KEY] = selections
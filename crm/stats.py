@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+In-process statistics for views wrapped with render_with.
+
+Set CRM_VIEW_STATS = True to enable them.  Each request then records its
+query count and time, view and template render times and response size,
+logs them on the 'crm.stats' logger and adds them to per-view histograms.
+The histograms live in the process, so each worker reports its own.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger('crm.stats')
+
+TIME_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+COUNT_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BOUNDS = tuple([kb * 1024 for kb in (1, 4, 16, 64, 256, 1024, 4096)])
+
+METRICS = (
+    ('queries', COUNT_BOUNDS),
+    ('query_ms', TIME_BOUNDS),
+    ('view_ms', TIME_BOUNDS),
+    ('render_ms', TIME_BOUNDS),
+    ('response_bytes', SIZE_BOUNDS),
+)
+
+
+def enabled():
+    return getattr(settings, 'CRM_VIEW_STATS', False)
+
+
+class Histogram(object):
+    """
+    Counts values into fixed buckets; the last bucket holds everything
+    above the highest bound.
+    """
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+    
+    def add(self, value):
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            index = len(self.bounds)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+    
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the given percentile
+        (the maximum seen, for the overflow bucket).
+        """
+        if not self.count:
+            return None
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                break
+        return self.max
+    
+    def as_dict(self):
+        buckets = []
+        for index, count in enumerate(self.counts):
+            if index < len(self.bounds):
+                buckets.append(['<=%s' % self.bounds[index], count])
+            else:
+                buckets.append(['>%s' % self.bounds[-1], count])
+        return {
+            'count': self.count,
+            'mean': self.count and float(self.total) / self.count or 0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': buckets,
+        }
+
+
+class ViewStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.views = {}
+        finally:
+            self.lock.release()
+    
+    def record(self, view_name, **values):
+        self.lock.acquire()
+        try:
+            if view_name not in self.views:
+                self.views[view_name] = dict([
+                    (metric, Histogram(bounds)) for metric, bounds in METRICS
+                ])
+            histograms = self.views[view_name]
+            for metric, bounds in METRICS:
+                histograms[metric].add(values[metric])
+        finally:
+            self.lock.release()
+        logger.info(
+            'view=%s status=%s queries=%d query_ms=%.1f view_ms=%.1f '
+            'render_ms=%.1f response_bytes=%d',
+            view_name,
+            values.get('status'),
+            values['queries'],
+            values['query_ms'],
+            values['view_ms'],
+            values['render_ms'],
+            values['response_bytes'],
+        )
+    
+    def snapshot(self):
+        self.lock.acquire()
+        try:
+            return dict([
+                (view_name, dict([
+                    (metric, histogram.as_dict())
+                    for metric, histogram in histograms.items()
+                ]))
+                for view_name, histograms in self.views.items()
+            ])
+        finally:
+            self.lock.release()
+
+
+view_stats = ViewStats()
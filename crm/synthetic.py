@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Synthetic data for benchmarks.  Rows are written with executemany() rather
+than through the ORM, so no model save() methods or signals run.
+"""
+
+import datetime
+import random
+
+from django.db import connection, models
+from django.utils.hashcompat import sha_constructor
+
+from contactinfo import models as contactinfo
+
+from crm import models as crm
+
+BATCH_SIZE = 1000
+
+
+def bulk_insert(model, rows, batch_size=BATCH_SIZE):
+    """
+    Inserts rows, an iterable of dictionaries keyed by field attname, into
+    the table of model.  Missing fields get their default value.
+    """
+    qn = connection.ops.quote_name
+    fields = [
+        f for f in model._meta.local_fields
+        if not isinstance(f, models.AutoField)
+    ]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields)),
+    )
+    cursor = connection.cursor()
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append([row.get(f.attname, f.get_default()) for f in fields])
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def seed_contacts(count, type='individual', prefix='synthetic'):
+    """
+    Creates count contacts with slugs starting with prefix and returns
+    their ids.
+    """
+    slug_prefix = '%s-%s-%d-' % (prefix, type, random.randint(0, 1000000))
+    
+    def rows():
+        for i in xrange(count):
+            first_name = 'First%d' % i
+            last_name = 'Last%d' % (i % 5000)
+            row = {
+                'type': type,
+                'slug': '%s%d' % (slug_prefix, i),
+            }
+            if type == 'business':
+                row['name'] = 'Business %d' % i
+                row['sort_name'] = 'business-%d' % i
+            else:
+                row['first_name'] = first_name
+                row['last_name'] = last_name
+                row['sort_name'] = '%s-%s' % (last_name, first_name)
+                row['email'] = '%s%d@example.com' % (first_name.lower(), i)
+                row['email_normalized'] = row['email']
+            yield row
+    bulk_insert(crm.Contact, rows())
+    return list(crm.Contact.objects.filter(
+        slug__startswith=slug_prefix,
+    ).values_list('pk', flat=True))
+
+
+def seed_relationships(contact_ids, count):
+    """
+    Relates random pairs of the given contacts until count relationship
+    rows (each relationship is stored in both directions) exist.
+    """
+    pairs = set()
+    limit = len(contact_ids) * (len(contact_ids) - 1) / 2
+    while len(pairs) * 2 < count and len(pairs) < limit:
+        a, b = random.sample(contact_ids, 2)
+        pairs.add((min(a, b), max(a, b)))
+    
+    def rows():
+        for a, b in pairs:
+            yield {'from_contact_id': a, 'to_contact_id': b}
+            yield {'from_contact_id': b, 'to_contact_id': a}
+    return bulk_insert(crm.ContactRelationship, rows())
+
+
+def _max_pk(model):
+    return model.objects.aggregate(models.Max('pk'))['pk__max'] or 0
+
+
+def _ids_after(model, pk):
+    return list(model.objects.filter(pk__gt=pk).order_by('pk').values_list(
+        'pk',
+        flat=True,
+    ))
+
+
+def seed_locations(contact_ids):
+    """
+    Gives each of the given contacts a location with one address and one
+    phone number, and returns the ids of the new locations.
+    """
+    before = _max_pk(contactinfo.Location)
+    bulk_insert(contactinfo.Location, ({} for pk in contact_ids))
+    location_ids = _ids_after(contactinfo.Location, before)
+    
+    def addresses():
+        for i, location_id in enumerate(location_ids):
+            yield {
+                'location_id': location_id,
+                'street': '%d Synthetic St.' % i,
+                'city': 'Chapel Hill',
+                'state_province': 'NC',
+                'postal_code': '27516',
+            }
+    bulk_insert(contactinfo.Address, addresses())
+    
+    def phones():
+        for i, location_id in enumerate(location_ids):
+            yield {
+                'location_id': location_id,
+                'number': '919-%03d-%04d' % (i / 10000 % 1000, i % 10000),
+            }
+    bulk_insert(contactinfo.Phone, phones())
+    
+    through = crm.Contact.locations.through
+    bulk_insert(through, [
+        {'contact_id': contact_id, 'location_id': location_id}
+        for contact_id, location_id in zip(contact_ids, location_ids)
+    ])
+    return location_ids
+
+
+def seed_employees(business_ids, person_ids):
+    """
+    Relates each person to a random business (in both directions, the way
+    the business views do) and returns the number of rows written.
+    """
+    def rows():
+        for person_id in person_ids:
+            business_id = random.choice(business_ids)
+            yield {'from_contact_id': business_id, 'to_contact_id': person_id}
+            yield {'from_contact_id': person_id, 'to_contact_id': business_id}
+    return bulk_insert(crm.ContactRelationship, rows())
+
+
+def seed_interactions(contact_ids, count, contacts_per_interaction=2):
+    """
+    Creates count interactions over the past year, each involving up to
+    contacts_per_interaction of the given contacts, and returns their ids.
+    """
+    now = datetime.datetime.now()
+    types = [value for value, label in crm.Interaction.INTERACTION_TYPES]
+    before = _max_pk(crm.Interaction)
+    
+    def rows():
+        for i in xrange(count):
+            date = now - datetime.timedelta(minutes=random.randint(
+                -60 * 24 * 30,
+                60 * 24 * 365,
+            ))
+            yield {
+                'date': date,
+                'type': random.choice(types),
+                'completed': date < now,
+                'memo': 'Synthetic interaction %d' % i,
+            }
+    bulk_insert(crm.Interaction, rows())
+    interaction_ids = _ids_after(crm.Interaction, before)
+    
+    def participants():
+        size = min(contacts_per_interaction, len(contact_ids))
+        for interaction_id in interaction_ids:
+            for contact_id in random.sample(contact_ids, size):
+                yield {
+                    'interaction_id': interaction_id,
+                    'contact_id': contact_id,
+                }
+    bulk_insert(crm.Interaction.contacts.through, participants())
+    return interaction_ids
+
+
+def seed_registrations(contact_ids):
+    """
+    Creates a pending login registration for each of the given contacts.
+    """
+    now = datetime.datetime.now()
+    
+    def rows():
+        for contact_id in contact_ids:
+            key = sha_constructor('%s%s' % (
+                random.random(),
+                contact_id,
+            )).hexdigest()
+            yield {
+                'contact_id': contact_id,
+                'date': now,
+                'activation_key': key,
+            }
+    return bulk_insert(crm.LoginRegistration, rows())
@@ -14,13 +14,212 @@
 #
 
 from django import template
+from django.core.urlresolvers import reverse
+
+from contactinfo import models as contactinfo
+
+from crm import models as crm
+from crm import rendering
+from crm.integrations import timepiece
 
 register = template.Library()
 
+
+def project_relationship_labels(project, contacts=None):
+    """
+    Returns a dictionary mapping contact ids to the relationship label for
+    each contact on the given project, loaded with at most two queries.
+    
+    Every contact related to the project is in the dictionary, with an
+    empty label if its relationship has no types.  If a list of contacts is
+    given, only those contacts are loaded, and any of them not on the
+    project map to an empty label too.
+    """
+    labels = {}
+    filters = {}
+    if contacts is None:
+        related = timepiece.ProjectRelationship.objects.filter(
+            project=project,
+        ).values_list('contact', flat=True)
+    else:
+        related = [getattr(c, 'pk', c) for c in contacts]
+        filters['contact__in'] = related
+    for contact_id in related:
+        labels[contact_id] = []
+    # values_list() can't follow the many-to-many itself, so read its table
+    types = timepiece.ProjectRelationship._meta.get_field('types')
+    relationship = types.m2m_field_name()
+    relationship_type = types.m2m_reverse_field_name()
+    filters['project'] = project
+    rows = types.rel.through.objects.filter(**dict([
+        ('%s__%s' % (relationship, k), v) for k, v in filters.items()
+    ])).order_by('%s__name' % relationship_type).values_list(
+        '%s__contact' % relationship,
+        '%s__name' % relationship_type,
+    )
+    for contact_id, name in rows:
+        labels.setdefault(contact_id, []).append(name)
+    for contact_id, names in labels.iteritems():
+        labels[contact_id] = ', '.join(names)
+    return labels
+
+
+class ProjectRelationshipLabelsNode(template.Node):
+    def __init__(self, project, contacts=None):
+        self.project = template.Variable(project)
+        if contacts:
+            self.contacts = template.Variable(contacts)
+        else:
+            self.contacts = None
+    
+    def render(self, context):
+        project = self.project.resolve(context)
+        contacts = None
+        if self.contacts:
+            contacts = self.contacts.resolve(context)
+        labels = project_relationship_labels(project, contacts)
+        # the project_relationship filter has no access to the context, so
+        # hang the labels off the project instance it will be given
+        project._relationship_labels = labels
+        context['project_relationship_labels'] = labels
+        return ''
+
+
+@register.tag(name='load_project_relationships')
+def do_load_project_relationships(parser, token):
+    """
+    Preloads the relationship labels for a project so that subsequent uses
+    of the project_relationship filter don't query the database:
+    
+    {% load_project_relationships project %}
+    {% load_project_relationships project for contacts %}
+    """
+    bits = token.split_contents()
+    if len(bits) == 2:
+        return ProjectRelationshipLabelsNode(bits[1])
+    elif len(bits) == 4 and bits[2] == 'for':
+        return ProjectRelationshipLabelsNode(bits[1], bits[3])
+    raise template.TemplateSyntaxError(
+        "Usage: {%% %s <project> [for <contacts>] %%}" % bits[0]
+    )
+
+
+def load_locations(contacts):
+    """
+    Hangs location_list off each contact, and phone_list and address_list
+    off each of those locations, using three queries for all the contacts.
+    """
+    contacts = list(contacts)
+    if not contacts:
+        return contacts
+    locations = {}
+    for contact in contacts:
+        contact.location_list = []
+    by_pk = dict([(contact.pk, contact) for contact in contacts])
+    links = crm.Contact.locations.through.objects.filter(
+        contact__in=by_pk.keys(),
+    ).select_related('location').order_by('location')
+    for link in links:
+        if link.location_id not in locations:
+            location = locations[link.location_id] = link.location
+            location.phone_list = []
+            location.address_list = []
+        location = locations[link.location_id]
+        by_pk[link.contact_id].location_list.append(location)
+    if locations:
+        for phone in contactinfo.Phone.objects.filter(
+            location__in=locations.keys(),
+        ).order_by('id'):
+            locations[phone.location_id].phone_list.append(phone)
+        for address in contactinfo.Address.objects.filter(
+            location__in=locations.keys(),
+        ).order_by('id'):
+            locations[address.location_id].address_list.append(address)
+    return contacts
+
+
+def load_interaction_contacts(interactions):
+    """
+    Hangs contact_list off each interaction, using one query for all the
+    interactions.
+    """
+    interactions = list(interactions)
+    by_pk = {}
+    for interaction in interactions:
+        interaction.contact_list = []
+        by_pk[interaction.pk] = interaction
+    if by_pk:
+        links = crm.Interaction.contacts.through.objects.filter(
+            interaction__in=by_pk.keys(),
+        ).select_related('contact').order_by('contact')
+        for link in links:
+            by_pk[link.interaction_id].contact_list.append(link.contact)
+    return interactions
+
+
+class PreloadNode(template.Node):
+    def __init__(self, loader, objects):
+        self.loader = loader
+        self.objects = template.Variable(objects)
+    
+    def render(self, context):
+        # evaluating the queryset here fills its result cache, so the
+        # template's own loop over it sees the annotated instances
+        self.loader(self.objects.resolve(context))
+        return ''
+
+
+def preload_tag(name, loader):
+    def do_preload(parser, token):
+        bits = token.split_contents()
+        if len(bits) != 2:
+            raise template.TemplateSyntaxError(
+                "Usage: {%% %s <queryset> %%}" % bits[0]
+            )
+        return PreloadNode(loader, bits[1])
+    do_preload.__doc__ = loader.__doc__
+    register.tag(name, do_preload)
+
+preload_tag('load_locations', load_locations)
+preload_tag('load_interaction_contacts', load_interaction_contacts)
+
+
 @register.filter(name='project_relationship')
 def project_relationship(user, project):
-    label = user.projectrelationship_set.get(project=project).get_label()
+    labels = getattr(project, '_relationship_labels', None)
+    if labels is not None and user.pk in labels:
+        label = labels[user.pk]
+    else:
+        label = user.projectrelationship_set.get(project=project).get_label()
     if label:
         label = '(%s)' % label
     return label
 project_relationship.is_safe = True
+
+
+@register.filter(name='rendered')
+def rendered(instance, field):
+    """
+    The stored HTML of a markup field:
+    
+    {{ interaction|rendered:"memo" }}
+    """
+    return rendering.get_rendered(instance, field)
+rendered.is_safe = True
+
+
+@register.filter(name='thumbnail_url')
+def thumbnail_url(contact, size):
+    """
+    The URL of a fixed-size thumbnail of the contact's picture, or '' if
+    there is no picture:
+    
+    {{ contact|thumbnail_url:"small" }}
+    """
+    if not contact.picture:
+        return ''
+    kwargs = {'contact_id': contact.pk, 'size': size}
+    if contact.picture_hash:
+        kwargs['picture_hash'] = contact.picture_hash
+        return reverse('contact_thumbnail', kwargs=kwargs)
+    return reverse('contact_thumbnail_latest', kwargs=kwargs)
@@ -13,6 +13,10 @@
 #    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
 #
 
+import os
+import re
+import base64
+import datetime
 import cStringIO
 import xmlrpclib
 import unittest
@@ -24,13 +28,30 @@ from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User, Permission, Group
 from django.test import Client, TestCase
+from django.utils import simplejson as json
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import slugify
-from django.template import RequestContext
+from django.template import Context, RequestContext, Template
 from django import forms
 from django.core import mail
+from django.core.cache import get_cache
+from django.core.management import call_command
 
 from crm import models as crm
+from crm.decorators import basicauth_user
+from crm import duplicates
+from crm import graph
+from crm import caching
+from crm import indexes
+from crm import integrations
+from crm.instrumentation import QueryCapture
+from crm import notifications
+from crm import paginators
+from crm import permissions
+from crm import rendering
+from crm import routers
+from crm import stats
+from crm import synthetic
 from contactinfo import models as contactinfo
 
 
@@ -74,6 +95,44 @@ class CrmDataTestCase(TestCase):
         errors = [form.errors for form in forms if form.errors]
         self.assertTrue(len(errors) > 0)
 
+    def count_queries(self, func, *args, **kwargs):
+        capture = QueryCapture().start()
+        try:
+            func(*args, **kwargs)
+        finally:
+            capture.stop()
+        return capture.count
+    
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        """
+        Make sure func(*args, **kwargs) runs no more than budget queries.
+        """
+        count = self.count_queries(func, *args, **kwargs)
+        self.assertTrue(
+            count <= budget,
+            '%d queries run, budget is %d' % (count, budget),
+        )
+        return count
+    
+    def assertQueriesDoNotGrow(self, func, grow, budget=None):
+        """
+        Make sure func runs the same number of queries (at most budget) before
+        and after grow() adds more rows for it to show.
+        """
+        func() # warm up per-process caches
+        small = self.count_queries(func)
+        grow()
+        large = self.count_queries(func)
+        self.assertTrue(
+            large <= small,
+            'query count grew with the data from %d to %d' % (small, large),
+        )
+        if budget is not None:
+            self.assertTrue(
+                large <= budget,
+                '%d queries run, budget is %d' % (large, budget),
+            )
+    
     def create_relationship(self, data={}):
         defaults = {}
         defaults.update(data)
@@ -104,6 +163,18 @@ class CrmDataTestCase(TestCase):
         return crm.Contact.objects.create(**defaults)
 
 
+# Pages whose query count must not depend on the number of rows they show:
+# url name -> (function of the test case returning the URL kwargs, budget)
+QUERY_BUDGETS = {
+    'crm_dashboard': (lambda test: {}, 20),
+    'list_people': (lambda test: {}, 20),
+    'list_businesses': (lambda test: {}, 20),
+    'list_interactions': (lambda test: {}, 20),
+    'view_person': (lambda test: {'person_id': test.contact.pk}, 25),
+    'view_business': (lambda test: {'business_id': test.business.pk}, 25),
+}
+
+
 class TestTransport(xmlrpclib.Transport):
     """ Handles connections to XML-RPC server through Django test client."""
     
@@ -153,6 +224,98 @@ class XMLRPCTestCase(TestCase):
             self.rpc_client.authenticate(username, password),
             'user %s failed to authenticate with %s' % (username, password,)
         )
+    
+    def testCalleridBatch(self):
+        business = crm.Contact.objects.create(
+            type='business',
+            name='Acme',
+            sort_name='acme',
+            slug='acme',
+        )
+        location = contactinfo.Location.objects.create()
+        business.locations.add(location)
+        location.phones.create(number='919-555-1212')
+        self.assertEqual(
+            self.rpc_client.callerid_batch(['1 (919) 555-1212', '9195550000']),
+            ['Acme', '919-555-0000'],
+        )
+        multicall = xmlrpclib.MultiCall(self.rpc_client)
+        multicall.callerid('919.555.1212')
+        self.assertEqual(list(multicall()), ['Acme'])
+        # a later business with the same number doesn't take it over
+        other = crm.Contact.objects.create(
+            type='business',
+            name='Zenith',
+            sort_name='zenith',
+            slug='zenith',
+        )
+        location = contactinfo.Location.objects.create()
+        other.locations.add(location)
+        location.phones.create(number='919-555-1212')
+        self.assertEqual(self.rpc_client.callerid('9195551212'), 'Acme')
+    
+    def testContactIdsCacheInvalidation(self):
+        from crm.xmlrpc import _get_contact_ids
+        user = User.objects.create_user('jane', 'jane@b.com', 'moo000')
+        self.assertEqual(_get_contact_ids(['jane']), {})
+        contact = crm.Contact.objects.create(
+            type='individual',
+            first_name='Jane',
+            sort_name='jane',
+            slug='jane',
+            user=user,
+        )
+        self.assertEqual(
+            _get_contact_ids(['jane', 'jane@b.com']),
+            {'jane': contact.pk, 'jane@b.com': contact.pk},
+        )
+        user.username = 'janet'
+        user.save()
+        self.assertEqual(_get_contact_ids(['jane']), {})
+    
+    def testContactIdsUseAccountEmail(self):
+        from crm.xmlrpc import _get_contact_ids
+        user = User.objects.create_user('jane', 'Jane@B.com', 'moo000')
+        contact = crm.Contact.objects.create(
+            type='individual',
+            first_name='Jane',
+            sort_name='jane',
+            slug='jane',
+            email='jane@contact.com',
+            user=user,
+        )
+        self.assertEqual(
+            _get_contact_ids(['jane@b.com', 'jane@contact.com']),
+            {'jane@b.com': contact.pk},
+        )
+
+
+class BasicAuthTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('joe', 'joe@b.com', 'moo000')
+        self.header = 'Basic %s' % base64.b64encode('joe:moo000')
+    
+    def testCachedCredentials(self):
+        self.assertEqual(basicauth_user(self.header), self.user)
+        self.assertEqual(basicauth_user(self.header), self.user)
+        self.assertEqual(
+            basicauth_user('Basic %s' % base64.b64encode('joe:wrong')),
+            None,
+        )
+    
+    def testPasswordHashNotCached(self):
+        from django.core.cache import cache
+        from crm.decorators import _basicauth_cache_key
+        self.assertEqual(basicauth_user(self.header), self.user)
+        verified = cache.get(_basicauth_cache_key(self.header))
+        self.assertTrue(verified)
+        self.assertFalse(self.user.password in verified.values())
+    
+    def testPasswordChangeInvalidates(self):
+        self.assertEqual(basicauth_user(self.header), self.user)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(basicauth_user(self.header), None)
 
 
 class ContactTestCase(TestCase):
@@ -310,6 +473,7 @@ class ContactTestCase(TestCase):
             data
         )
         self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.contact.history.count(), 0)
         
         data = {
             u'first_name': [u'John'],
@@ -356,6 +520,34 @@ class ContactTestCase(TestCase):
             data
         )
         self.assertEqual(len(mail.outbox), 1)
+        record = self.contact.history.get()
+        self.assertEqual(
+            [(c['old'], c['new']) for c in record.get_changes()],
+            [(u'999-999-9999', u'888-888-8888')],
+        )
+        self.assertTrue('888-888-8888' in mail.outbox[0].body)
+        
+        response = self.client.get(
+            reverse('person_history', args=[self.contact.pk]),
+        )
+        self.assertContains(response, '888-888-8888')
+        
+        # saving the same location again changes nothing
+        response = self.client.post(
+            reverse('edit_person', args=[self.contact.pk]),
+            data
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.contact.history.count(), 1)
+    
+    def testEmailNormalized(self):
+        self.assertEqual(self.contact.email_normalized, 'john@doe.com')
+        self.contact.email = ' John@Doe.COM'
+        self.contact.save()
+        self.assertEqual(
+            crm.Contact.objects.get(email_normalized='john@doe.com'),
+            self.contact,
+        )
     
     def testContactSlugs(self):
         self.client.login(username='admin', password='abc123')
@@ -370,7 +562,7 @@ class ContactTestCase(TestCase):
         self.assertEqual(contact.sort_name, self.contact.sort_name)
 
 
-class LoginRegistrationTestCase(TestCase):
+class LoginRegistrationTestCase(CrmDataTestCase):
     def setUp(self):
         self.contact = crm.Contact.objects.create(
             first_name='John',
@@ -401,11 +593,727 @@ class LoginRegistrationTestCase(TestCase):
             )
         )
     
+    def testAllocateUsername(self):
+        self.assertEqual(crm.allocate_username('John Doe'), 'john-doe')
+        for username in ('john-doe', 'john-doe1', 'john-doe9', 'john-doex'):
+            User.objects.create_user(username, '', 'abc')
+        self.assertEqual(crm.allocate_username('John Doe'), 'john-doe10')
+        self.assertEqual(crm.allocate_username('!!!'), 'user')
+    
+    def testActivate(self):
+        group = Group.objects.create(name='Clients')
+        self.registration.groups.add(group)
+        # allocate, insert the user, update the contact and the
+        # registration, look up and add the groups
+        self.assertQueryBudget(7, self.registration.activate, 'abc')
+        contact = crm.Contact.objects.get(pk=self.contact.pk)
+        self.assertEqual(contact.user.username, 'john-doe')
+        self.assertEqual(list(contact.user.groups.all()), [group])
+        self.assertTrue(
+            crm.LoginRegistration.objects.get(pk=self.registration.pk).activated
+        )
+        # a second activation doesn't replace the user
+        self.assertEqual(self.registration.activate('abc'), None)
+        self.assertEqual(User.objects.filter(email='john@doe.com').count(), 1)
+    
+    def testSelectionRegistration(self):
+        from django.contrib.admin import ACTION_CHECKBOX_NAME
+        admin = User.objects.create_user('admin', 'admin@abc.com', 'abc123')
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        self.client.login(username='admin', password='abc123')
+        response = self.client.post('/admin/crm/contact/', {
+            'action': 'send_account_activation_email',
+            ACTION_CHECKBOX_NAME: [self.contact.pk],
+            'select_across': '0',
+            'index': '0',
+        })
+        self.assertEqual(response.status_code, 302)
+        url = response['Location']
+        self.assertTrue('selection=' in url)
+        response = self.client.get(url)
+        self.assertEqual(response.context['selection_count'], 1)
+        response = self.client.post(url, {})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.contact.email])
+    
     def testAlreadyLoggedInActivation(self):
         user = User.objects.create_user('test', 'test@test.com', 'test')
         self.client.login(username='test', password='test')
         url = reverse('activate_login', args=[self.registration.activation_key])
         response = self.client.get(url, follow=True)
         self.assertContains(response, "already logged in")
+
+
+class QuickSearchContextTestCase(TestCase):
+    def testFormIsLazy(self):
+        from crm.context_processors import quick_search
+        form = quick_search(None)['quick_search_form']
+        self.assertEqual(form._wrapped, None)
+        self.assertTrue('quick_search' in unicode(form))
+        self.assertTrue(isinstance(form._wrapped, forms.Form))
+    
+    def testRenderingsDependOnAttrs(self):
+        from crm.forms import CharAutoCompleteSelectWidget
+        plain = CharAutoCompleteSelectWidget('quick_search')
+        wide = CharAutoCompleteSelectWidget(
+            'quick_search',
+            attrs={'size': '40'},
+        )
+        self.assertNotEqual(plain.render('q', None), wide.render('q', None))
+        self.assertEqual(wide.render('q', None), wide.render('q', None))
+
+
+class ViewStatsTestCase(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', 'staff@abc.com', 'abc')
+        self.staff.is_staff = True
+        self.staff.is_superuser = True
+        self.staff.save()
+        self.client.login(username='staff', password='abc')
+        self.old_setting = getattr(settings, 'CRM_VIEW_STATS', False)
+        settings.CRM_VIEW_STATS = True
+        stats.view_stats.reset()
+    
+    def tearDown(self):
+        settings.CRM_VIEW_STATS = self.old_setting
+        stats.view_stats.reset()
+    
+    def testHistogram(self):
+        histogram = stats.Histogram((1, 10, 100))
+        for value in (0, 5, 5, 50, 500):
+            histogram.add(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual(histogram.percentile(100), 500)
+    
+    def testViewsAreMeasured(self):
+        response = self.client.get(reverse('list_people'))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('crm_view_stats'))
+        data = json.loads(response.content)
+        people = data['views']['list_people']
+        self.assertEqual(people['queries']['count'], 1)
+        self.assertTrue(people['queries']['max'] > 0)
+        self.assertTrue(people['response_bytes']['max'] > 0)
+    
+    def testStaffOnly(self):
+        User.objects.create_user('plain', 'plain@abc.com', 'abc')
+        self.client.login(username='plain', password='abc')
+        response = self.client.get(reverse('crm_view_stats'))
+        self.assertEqual(response.status_code, 302)
+
+
+class QueryBudgetTestCase(CrmDataTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('admin', 'admin@abc.com', 'abc')
+        self.user.is_superuser = True
+        self.user.save()
+        self.contact = self.create_person({'user': self.user})
+        self.business = self.create_business()
+        self.client.login(username='admin', password='abc')
+        self.populate(2)
+    
+    def populate(self, count):
+        """
+        Adds count people, each with a phone, an address, a job at
+        self.business and an interaction with self.contact.
+        """
+        for i in range(count):
+            person = self.create_person()
+            business = self.create_business()
+            for contact in (person, business):
+                location = contactinfo.Location.objects.create()
+                contact.locations.add(location)
+                location.phones.create(number='919-555-%04d' % i)
+                location.addresses.create(
+                    street='%d Generic St.' % i,
+                    city='Chapel Hill',
+                    state_province='NC',
+                    postal_code=27516,
+                )
+            self.create_relationship({
+                'from_contact': self.business,
+                'to_contact': person,
+            })
+            self.create_relationship({
+                'from_contact': person,
+                'to_contact': self.business,
+            })
+            for completed in (True, False):
+                interaction = crm.Interaction.objects.create(
+                    date=datetime.datetime.now(),
+                    type='meeting',
+                    completed=completed,
+                )
+                interaction.contacts.add(self.contact, person)
+    
+    def testQueryBudgets(self):
+        for name, (kwargs, budget) in QUERY_BUDGETS.items():
+            url = reverse(name, kwargs=kwargs(self))
+            self.assertQueriesDoNotGrow(
+                lambda: self.assertEqual(self.client.get(url).status_code, 200),
+                lambda: self.populate(8),
+                budget,
+            )
+    
+    def testInteractionAdmin(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertQueriesDoNotGrow(
+            lambda: self.assertEqual(
+                self.client.get('/admin/crm/interaction/').status_code,
+                200,
+            ),
+            lambda: self.populate(8),
+            15,
+        )
+    
+    def testEstimatedCount(self):
+        old_threshold = getattr(settings, 'CRM_ESTIMATED_COUNT_THRESHOLD',
+                                paginators.DEFAULT_THRESHOLD)
+        try:
+            settings.CRM_ESTIMATED_COUNT_THRESHOLD = 1
+            interactions = crm.Interaction.objects.all()
+            paginator = paginators.EstimatedCountPaginator(interactions, 2)
+            self.assertTrue(paginator.count >= interactions.count())
+            self.assertTrue(paginator.estimated)
+            completed = interactions.filter(completed=True)
+            paginator = paginators.EstimatedCountPaginator(completed, 2)
+            self.assertEqual(paginator.count, completed.count())
+            self.assertFalse(paginator.estimated)
+            settings.CRM_ESTIMATED_COUNT_THRESHOLD = None
+            paginator = paginators.EstimatedCountPaginator(interactions, 2)
+            self.assertEqual(paginator.count, interactions.count())
+        finally:
+            settings.CRM_ESTIMATED_COUNT_THRESHOLD = old_threshold
+
+
+class ProjectRelationshipLabelsTestCase(CrmDataTestCase):
+    def setUp(self):
+        if not integrations.timepiece:
+            return
+        self.user = User.objects.create_user('admin', 'admin@abc.com', 'abc')
+        self.project = integrations.timepiece.Project.objects.create(
+            name='Project',
+            trac_environment='project',
+            business=self.create_business(),
+            point_person=self.user,
+        )
+        self.developer = crm.RelationshipType.objects.create(
+            name='Developer',
+            slug='developer',
+        )
+        self.manager = crm.RelationshipType.objects.create(
+            name='Manager',
+            slug='manager',
+        )
+    
+    def relate(self, *types):
+        contact = self.create_person()
+        relationship = \
+            integrations.timepiece.ProjectRelationship.objects.create(
+                contact=contact,
+                project=self.project,
+            )
+        for relationship_type in types:
+            relationship.types.add(relationship_type)
+        return contact
+    
+    def testLabelsWithoutContactList(self):
+        if not integrations.timepiece:
+            return
+        typed = self.relate(self.manager, self.developer)
+        untyped = self.relate()
+        t = Template(
+            '{% load crm_tags %}{% load_project_relationships project %}'
+            '{% for contact in contacts %}'
+            '[{{ contact|project_relationship:project }}]'
+            '{% endfor %}'
+        )
+        context = Context({
+            'project': self.project,
+            'contacts': [typed, untyped],
+        })
+        self.assertQueryBudget(2, t.render, context)
+        self.assertEqual(
+            t.render(context),
+            '[(Developer, Manager)][]',
+        )
+        for i in range(3):
+            context['contacts'].append(self.relate(self.developer))
+            context['contacts'].append(self.relate())
+        self.assertQueryBudget(2, t.render, context)
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    # not a django TestCase: its transaction would pin every read to the
+    # primary
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.old_alias = getattr(settings, 'CRM_REPLICA_DATABASE', None)
+        settings.CRM_REPLICA_DATABASE = 'replica'
+        self.added_database = 'replica' not in settings.DATABASES
+        if self.added_database:
+            settings.DATABASES['replica'] = settings.DATABASES['default']
+        routers.reset()
     
+    def tearDown(self):
+        settings.CRM_REPLICA_DATABASE = self.old_alias
+        if self.added_database:
+            del settings.DATABASES['replica']
+        routers.reset()
+    
+    def read(self):
+        return self.router.db_for_read(crm.Contact)
+    
+    def testRouting(self):
+        self.assertEqual(self.read(), 'default')
+        self.assertEqual(routers.use_replica(self.read)(), 'replica')
+        self.assertEqual(self.read(), 'default')
+    
+    def testReadYourWrites(self):
+        self.assertEqual(self.router.db_for_write(crm.Contact), 'default')
+        self.assertTrue(routers.has_written())
+        self.assertEqual(routers.use_replica(self.read)(), 'default')
+    
+    def testSessionWritesDoNotPin(self):
+        from django.contrib.sessions.models import Session
+        self.router.db_for_write(Session)
+        self.assertEqual(routers.use_replica(self.read)(), 'replica')
+    
+    def testDisabled(self):
+        settings.CRM_REPLICA_DATABASE = None
+        self.assertEqual(routers.use_replica(self.read)(), None)
+
+
+class RenderedMarkupTestCase(TestCase):
+    def testMemoRenderedOnSave(self):
+        interaction = crm.Interaction.objects.create(
+            date=datetime.datetime.now(),
+            type='meeting',
+            memo='Discussed *pricing*',
+        )
+        html = rendering.render('Discussed *pricing*', 'markdown')
+        self.assertEqual(interaction.memo_html, html)
+        # rows saved before the HTML was stored are rendered on the fly
+        crm.Interaction.objects.filter(pk=interaction.pk).update(memo_html='')
+        interaction = crm.Interaction.objects.get(pk=interaction.pk)
+        self.assertEqual(rendering.get_rendered(interaction, 'memo'), html)
+        interaction.memo = ''
+        interaction.save()
+        self.assertEqual(interaction.memo_html, '')
+
+
+class ThumbnailTestCase(CrmDataTestCase):
+    def testThumbnailUrls(self):
+        from crm.templatetags.crm_tags import thumbnail_url
+        person = self.create_person()
+        self.assertEqual(thumbnail_url(person, 'small'), '')
+        person.picture = 'picture/profile/face.png'
+        self.assertEqual(
+            thumbnail_url(person, 'small'),
+            reverse('contact_thumbnail_latest', kwargs={
+                'contact_id': person.pk,
+                'size': 'small',
+            }),
+        )
+        person.picture_hash = 'a' * 40
+        self.assertTrue(
+            thumbnail_url(person, 'small').endswith('/small/%s.jpg' % ('a' * 40))
+        )
+    
+    def testNoPicture(self):
+        User.objects.create_user('admin', 'admin@abc.com', 'abc')
+        self.client.login(username='admin', password='abc')
+        person = self.create_person()
+        url = reverse('contact_thumbnail_latest', kwargs={
+            'contact_id': person.pk,
+            'size': 'small',
+        })
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class CacheTimeoutTestCase(unittest.TestCase):
+    def testLocalCacheIsCapped(self):
+        old_backend = caching.cache
+        try:
+            caching.cache = get_cache('locmem://')
+            self.assertFalse(caching.is_shared())
+            self.assertEqual(
+                caching.timeout(3600),
+                getattr(settings, 'CRM_LOCAL_CACHE_SECONDS',
+                        caching.DEFAULT_LOCAL_CACHE_SECONDS),
+            )
+            caching.cache = get_cache('file:///tmp/crm-test-cache')
+            self.assertTrue(caching.is_shared())
+            self.assertEqual(caching.timeout(3600), 3600)
+        finally:
+            caching.cache = old_backend
+
+
+class IntegrationTestCase(unittest.TestCase):
+    def testMissingApp(self):
+        missing = integrations.Integration(
+            'missing',
+            'missing',
+            'missing.models',
+        )
+        self.assertFalse(missing)
+        self.assertFalse(missing.available)
+        self.assertRaises(AttributeError, getattr, missing, 'Project')
+    
+    def testInstalledApp(self):
+        auth = integrations.Integration(
+            'auth',
+            'django.contrib.auth',
+            'django.contrib.auth.models',
+        )
+        self.assertTrue(auth)
+        self.assertTrue(auth.User is User)
+    
+    def testCapabilities(self):
+        self.assertEqual(
+            sorted(integrations.capabilities().keys()),
+            ['members', 'minibooks', 'timepiece'],
+        )
+
+
+class PermissionCacheTestCase(CrmDataTestCase):
+    def testChecksAreCached(self):
+        user = User.objects.create_user('staff', 'staff@abc.com', 'abc')
+        user.user_permissions = Permission.objects.filter(
+            content_type__app_label='crm',
+            codename__in=('add_contact', 'change_contact'),
+        )
+        user = User.objects.get(pk=user.pk)
+        person = self.create_person()
+        self.assertTrue(person.is_editable_by(user))
+        self.assertQueryBudget(0, person.is_editable_by, user)
+        cache = permissions.for_user(user)
+        self.assertQueryBudget(0, cache.has_perms, (
+            'crm.add_contact',
+            'crm.change_contact',
+        ))
+        self.assertFalse(cache.has_perm('crm.delete_contact'))
+    
+    def testOwnContactWithoutPermissions(self):
+        user = User.objects.create_user('plain', 'plain@abc.com', 'abc')
+        person = self.create_person({'user': user})
+        # owning the contact isn't enough without a membership
+        self.assertFalse(person.is_editable_by(user))
+
+
+class NotificationRecipientsTestCase(CrmDataTestCase):
+    def testRecipientsCache(self):
+        group = Group.objects.create(name='Contact Notifications')
+        user = User.objects.create_user('jane', 'jane@abc.com', 'abc')
+        group.user_set.add(user)
+        self.assertEqual(
+            notifications.recipients('contact_changed'),
+            ['jane@abc.com'],
+        )
+        self.assertQueryBudget(
+            0,
+            notifications.recipients,
+            'contact_changed',
+        )
+        user.email = 'jane@xyz.com'
+        user.save()
+        self.assertEqual(
+            notifications.recipients('contact_changed'),
+            ['jane@xyz.com'],
+        )
+        group.user_set.remove(user)
+        self.assertEqual(notifications.recipients('contact_changed'), [])
+        self.assertEqual(notifications.recipients('unknown_change'), [])
+
+
+class MergeLocationsTestCase(CrmDataTestCase):
+    def create_location(self, contact, street):
+        location = contactinfo.Location.objects.create()
+        contact.locations.add(location)
+        location.addresses.create(
+            street=street,
+            city='Chapel Hill',
+            state_province='NC',
+            postal_code=27516,
+        )
+        return location
+    
+    def setUp(self):
+        self.person = self.create_person()
+        self.first = self.create_location(self.person, '1 First St.')
+        self.second = self.create_location(self.person, '2 Second St.')
+        self.shared = self.create_location(self.person, '3 Shared St.')
+        self.other = self.create_person()
+        self.other.locations.add(self.shared)
+    
+    def streets(self, location):
+        return sorted(location.addresses.values_list('street', flat=True))
+    
+    def testSharedLocation(self):
+        call_command('merge_locations', batch_size=1)
+        self.assertEqual(
+            sorted(self.person.locations.values_list('pk', flat=True)),
+            [self.first.pk, self.shared.pk],
+        )
+        self.assertEqual(
+            self.streets(self.first),
+            ['1 First St.', '2 Second St.'],
+        )
+        self.assertFalse(
+            contactinfo.Location.objects.filter(pk=self.second.pk).exists()
+        )
+        # the other contact keeps its only location, with its address
+        self.assertEqual(
+            list(self.other.locations.values_list('pk', flat=True)),
+            [self.shared.pk],
+        )
+        self.assertEqual(self.streets(self.shared), ['3 Shared St.'])
+    
+    def testDryRun(self):
+        call_command('merge_locations', dry_run=True)
+        self.assertEqual(self.person.locations.count(), 3)
+        self.assertEqual(self.streets(self.first), ['1 First St.'])
+        self.assertEqual(self.streets(self.second), ['2 Second St.'])
+
+
+class SyntheticDataTestCase(TestCase):
+    def testSeed(self):
+        people = synthetic.seed_contacts(10)
+        businesses = synthetic.seed_contacts(2, type='business')
+        locations = synthetic.seed_locations(people + businesses)
+        self.assertEqual(len(locations), 12)
+        self.assertEqual(
+            contactinfo.Phone.objects.filter(location__in=locations).count(),
+            12,
+        )
+        synthetic.seed_employees(businesses, people)
+        self.assertEqual(
+            crm.ContactRelationship.objects.filter(
+                from_contact__in=businesses,
+            ).count(),
+            10,
+        )
+        interactions = synthetic.seed_interactions(people, 5)
+        self.assertEqual(
+            crm.Interaction.contacts.through.objects.filter(
+                interaction__in=interactions,
+            ).count(),
+            10,
+        )
+        synthetic.seed_registrations(people[:3])
+        self.assertEqual(crm.LoginRegistration.objects.count(), 3)
+
+
+class DuplicateContactsTestCase(CrmDataTestCase):
+    def testSoundex(self):
+        self.assertEqual(duplicates.soundex('Robert'), 'R163')
+        self.assertEqual(duplicates.soundex('Rupert'), 'R163')
+        self.assertEqual(duplicates.soundex('Ashcraft'), 'A261')
+        self.assertEqual(duplicates.soundex(''), '')
+    
+    def testFindAndMerge(self):
+        john = self.create_person({
+            'first_name': 'John',
+            'last_name': 'Smith',
+            'email': 'john@smith.com',
+        })
+        jon = self.create_person({
+            'first_name': 'Jon',
+            'last_name': 'Smith',
+            'email': 'John@Smith.com ',
+        })
+        self.create_person({'first_name': 'Jane', 'last_name': 'Doe'})
+        pairs = duplicates.find_duplicates()
+        self.assertEqual([(a, b) for score, a, b in pairs], [(john.pk, jon.pk)])
+        
+        interaction = crm.Interaction.objects.create(
+            date=datetime.datetime.now(),
+            type='email',
+        )
+        interaction.contacts.add(john, jon)
+        business = self.create_business()
+        self.create_relationship({'from_contact': jon, 'to_contact': business})
+        duplicates.merge_contacts(john, [jon])
+        self.assertFalse(crm.Contact.objects.filter(pk=jon.pk).count())
+        self.assertEqual(list(interaction.contacts.all()), [john])
+        self.assertEqual(list(business.contacts.all()), [john])
+    
+    def testCandidatePhones(self):
+        people = []
+        for first_name in ('Ann', 'Bob', 'Cy'):
+            person = self.create_person({
+                'first_name': first_name,
+                'last_name': 'Doe',
+            })
+            location = contactinfo.Location.objects.create()
+            location.phones.create(number='(919) 555-1212')
+            person.locations.add(location)
+            people.append(person)
+        candidates = list(duplicates.iter_candidates(batch_size=2))
+        self.assertEqual([c.pk for c in candidates], [p.pk for p in people])
+        for candidate in candidates:
+            self.assertEqual(candidate.phones, ('9195551212',))
+    
+    def testMergeRepointsEveryRelation(self):
+        john = self.create_person({'first_name': 'John', 'last_name': 'Doe'})
+        jon = self.create_person({'first_name': 'Jon', 'last_name': 'Doe'})
+        history = crm.ContactHistory.objects.create(contact=jon, changes='{}')
+        registration = crm.LoginRegistration.objects.create(
+            contact=jon,
+            date=datetime.datetime.now(),
+            activation_key='key',
+        )
+        generation = caching.get_generation('contacts')
+        duplicates.merge_contacts(john, [jon])
+        self.assertEqual(list(john.history.all()), [history])
+        self.assertEqual(
+            crm.LoginRegistration.objects.get(pk=registration.pk).contact,
+            john,
+        )
+        self.assertNotEqual(caching.get_generation('contacts'), generation)
+    
+    def testMergeRepointsOptionalApps(self):
+        if not integrations.timepiece:
+            return
+        john = self.create_person({'first_name': 'John', 'last_name': 'Doe'})
+        jon = self.create_person({'first_name': 'Jon', 'last_name': 'Doe'})
+        user = User.objects.create_user('admin', 'admin@abc.com', 'abc')
+        project = integrations.timepiece.Project.objects.create(
+            name='Project',
+            trac_environment='project',
+            business=jon,
+            point_person=user,
+        )
+        relationship = \
+            integrations.timepiece.ProjectRelationship.objects.create(
+                contact=jon,
+                project=project,
+            )
+        duplicates.merge_contacts(john, [jon])
+        project = integrations.timepiece.Project.objects.get(pk=project.pk)
+        self.assertEqual(project.business, john)
+        self.assertEqual(
+            integrations.timepiece.ProjectRelationship.objects.get(
+                pk=relationship.pk,
+            ).contact,
+            john,
+        )
+
+
+class RelationshipGraphTestCase(CrmDataTestCase):
+    def setUp(self):
+        self.business = self.create_business()
+        self.other_business = self.create_business()
+        self.people = [self.create_person() for i in range(3)]
+        # business - person 0 - other business - person 1, person 2 alone
+        for from_contact, to_contact in (
+            (self.business, self.people[0]),
+            (self.people[0], self.other_business),
+            (self.other_business, self.people[1]),
+        ):
+            self.create_relationship({
+                'from_contact': from_contact,
+                'to_contact': to_contact,
+            })
+    
+    def testWithinHops(self):
+        expected = {
+            self.business.pk: 0,
+            self.people[0].pk: 1,
+            self.other_business.pk: 2,
+        }
+        self.assertEqual(graph.within_hops(self.business, 2), expected)
+        self.assertEqual(
+            graph.within_hops(self.business, 2, recursive=False),
+            expected,
+        )
+    
+    def testShortestPath(self):
+        self.assertEqual(
+            graph.shortest_path(self.business, self.people[1]),
+            [self.business.pk, self.people[0].pk, self.other_business.pk,
+             self.people[1].pk],
+        )
+        self.assertEqual(graph.shortest_path(self.business, self.people[2]),
+                         None)
+    
+    def testConnectedBusinesses(self):
+        self.assertEqual(
+            graph.connected_businesses(self.business),
+            {self.other_business.pk: set([self.people[0].pk])},
+        )
+
+
+class ReferenceDataTestCase(TestCase):
+    def setUp(self):
+        # cached copies survive the rollback between tests
+        caching.bump_generation(crm.BusinessType._meta.db_table)
+    
+    def testCacheInvalidation(self):
+        self.assertEqual(crm.BusinessType.objects.cached(), [])
+        client = crm.BusinessType.objects.create(name='Client')
+        self.assertEqual(
+            crm.BusinessType.objects.choices(),
+            [(client.pk, u'Client')],
+        )
+        client.delete()
+        self.assertEqual(crm.BusinessType.objects.cached(), [])
+
+
+class SchemaTestCase(unittest.TestCase):
+    def testHotPathIndexes(self):
+        try:
+            missing = [name for name, model, fields, purpose
+                       in indexes.missing_indexes()]
+        except NotImplementedError:
+            # no index introspection on this backend
+            return
+        self.assertEqual(missing, [], 'Missing indexes: %s' % missing)
+    
+    def migration_indexes(self):
+        """
+        Returns {index name: (table, columns)} for every index the SQL
+        migrations create.
+        """
+        directory = os.path.join(os.path.dirname(crm.__file__), 'migrations')
+        pattern = re.compile(
+            r'CREATE INDEX (?:IF NOT EXISTS )?"(\w+)" ON "(\w+)" \(([^()]*)\)'
+        )
+        created = {}
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.sql'):
+                continue
+            sql = open(os.path.join(directory, filename)).read()
+            for name, table, columns in pattern.findall(sql):
+                created[name] = (table, tuple([
+                    c.strip().strip('"') for c in columns.split(',')
+                ]))
+        return created
+    
+    def testMigrationsCreateIndexes(self):
+        created = self.migration_indexes()
+        for name, model, fields, purpose in indexes.INDEXES:
+            columns = tuple([model._meta.get_field(f).column for f in fields])
+            self.assertEqual(
+                created.get(name),
+                (model._meta.db_table, columns),
+                'No migration creates %s on %s %s' % (
+                    name,
+                    model._meta.db_table,
+                    columns,
+                ),
+            )
     
+    def testMigrationsAreIdempotent(self):
+        directory = os.path.join(os.path.dirname(crm.__file__), 'migrations')
+        for name, model, fields, purpose in indexes.INDEXES:
+            for filename in os.listdir(directory):
+                sql = open(os.path.join(directory, filename)).read()
+                self.assertFalse(
+                    'CREATE INDEX "%s"' % name in sql,
+                    '%s creates %s without IF NOT EXISTS' % (filename, name),
+                )
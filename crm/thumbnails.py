@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------------
+#
+#    Copyright (C) 2008-2009 Caktus Consulting Group, LLC
+#
+#    This file is part of django-crm and was originally extracted from minibooks.
+#
+#    django-crm is published under a BSD-style license.
+#    
+#    You should have received a copy of the BSD License along with django-crm.  
+#    If not, see <http://www.opensource.org/licenses/bsd-license.php>.
+#
+
+"""
+Fixed-size thumbnails of Contact.picture.
+
+Thumbnails are named after a hash of the original picture's contents
+(stored in Contact.picture_hash), so their URLs change whenever the
+picture does and can be cached by browsers indefinitely.  They are made
+on first request and kept in the picture's storage; generate_thumbnails
+makes them ahead of time.
+
+None of this touches the database, so it can run in worker processes.
+"""
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils.hashcompat import sha_constructor
+
+DEFAULT_SIZES = {
+    'small': (48, 48),
+    'medium': (160, 160),
+}
+THUMBNAIL_DIR = 'picture/thumbnails/'
+JPEG_QUALITY = 85
+
+
+def sizes():
+    return getattr(settings, 'CRM_THUMBNAIL_SIZES', DEFAULT_SIZES)
+
+
+def storage():
+    from crm import models as crm
+    return crm.Contact._meta.get_field('picture').storage
+
+
+def content_hash(f):
+    """ Hashes the contents of an open file, leaving it rewound """
+    digest = sha_constructor()
+    f.seek(0)
+    for chunk in f.chunks():
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def picture_hash(name):
+    f = storage().open(name)
+    try:
+        return content_hash(f)
+    finally:
+        f.close()
+
+
+def thumbnail_name(picture_hash, size):
+    width, height = sizes()[size]
+    return '%s%s-%dx%d.jpg' % (THUMBNAIL_DIR, picture_hash, width, height)
+
+
+def make_thumbnail(name, picture_hash, size):
+    """
+    Makes the thumbnail of the picture with the given storage name, unless
+    it exists already, and returns the thumbnail's name.
+    """
+    # imported here so that crm.models, which hashes uploads, doesn't need PIL
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    store = storage()
+    thumb = thumbnail_name(picture_hash, size)
+    if store.exists(thumb):
+        return thumb
+    f = store.open(name)
+    try:
+        image = Image.open(f)
+        image.load()
+    finally:
+        f.close()
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    image.thumbnail(sizes()[size], Image.ANTIALIAS)
+    output = StringIO()
+    image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    # another request may have beaten us to it
+    if not store.exists(thumb):
+        store.save(thumb, ContentFile(output.getvalue()))
+    return thumb
+
+
+def process_picture(args):
+    """
+    Makes every thumbnail of a picture.  Takes and returns (contact id,
+    picture name, picture hash) so it can be used with a process pool; the
+    hash is computed if it is empty.
+    """
+    pk, name, hash = args
+    if not hash:
+        hash = picture_hash(name)
+    for size in sizes():
+        make_thumbnail(name, hash, size)
+    return pk, name, hash
@@ -24,6 +24,8 @@ urlpatterns = patterns('',
     
     url(r'^search/$', views.quick_search, name='quick_search'),
     
+    url(r'^stats/$', views.view_stats, name='crm_view_stats'),
+    
     url(r'^interaction/$', views.list_interactions, name='list_interactions'),
     url(r'^(?:person/(?P<person_id>\d+)/)?interaction/create/$', views.create_edit_interaction, name='create_interaction'),
     url(r'^interaction/(?P<interaction_id>\d+)/edit/$', views.create_edit_interaction, name='edit_interaction'),
@@ -34,12 +36,23 @@ urlpatterns = patterns('',
     url(r'^person/register/$', views.register_person, name='register_person'),
     url(r'^person/(?P<person_id>\d+)/$', views.view_person, name='view_person'),
     url(r'^person/(?P<person_id>\d+)/edit/$', views.create_edit_person, name='edit_person'),
+    url(r'^person/(?P<person_id>\d+)/history/$', views.person_history, name='person_history'),
     
     url(
         r'^contact/(?P<contact_slug>[-\w]+)/email/$',
         views.email_contact,
         name='email_contact',
     ),
+    url(
+        r'^contact/(?P<contact_id>\d+)/picture/(?P<size>\w+)/(?P<picture_hash>[0-9a-f]{40})\.jpg$',
+        views.contact_thumbnail,
+        name='contact_thumbnail',
+    ),
+    url(
+        r'^contact/(?P<contact_id>\d+)/picture/(?P<size>\w+)/$',
+        views.contact_thumbnail,
+        name='contact_thumbnail_latest',
+    ),
     
     # businesses
     url(r'^business/list/$', views.list_businesses, name='list_businesses'),
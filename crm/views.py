@@ -14,29 +14,38 @@
 #
 
 import datetime
-import difflib
+import time
 
 from django.template import RequestContext, Context, loader
 from django.shortcuts import get_object_or_404, render_to_response
-from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.http import HttpResponseRedirect
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.utils import simplejson as json
 from django.http import HttpResponse, Http404
 from django.db.models import Q
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-from django.contrib.auth.models import User, Group
+from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login
 from django.core.mail import send_mass_mail, send_mail
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import http_date
 
 from contactinfo.helpers import create_edit_location
 from contactinfo import models as contactinfo
 
 from crm import models as crm
 from crm import forms as crm_forms
-from crm.decorators import render_with
+from crm import history
+from crm import notifications
+from crm.integrations import timepiece, ledger
+from crm import selections
+from crm import stats
+from crm import thumbnails
+from crm.decorators import render_with, permission_required
+from crm.routers import use_replica
 
 
 @login_required
@@ -71,7 +80,6 @@ def dashboard(request):
                 'status',
                 'type',
             ).exclude(status__label__in=('Closed', 'Complete'))
-            from timepiece import models as timepiece
             svn_accessible = timepiece.Project.objects.filter(
                 contacts=request.contact,
                 project_relationships__types__slug__startswith='svn-'
@@ -91,16 +99,13 @@ def dashboard(request):
         'projects': projects,
     }
     
-    try:
-        from minibooks.ledger.models import Exchange
+    if ledger:
         # there are no permissions on this view, so all DB access
         # must filter by request.user
-        context['recent_exchanges'] = Exchange.objects.filter(
+        context['recent_exchanges'] = ledger.Exchange.objects.filter(
             business__type='business',
             business__contacts=request.contact,
         ).select_related('type', 'business')[:10]
-    except ImportError:
-        pass
     
     return context
 
@@ -115,6 +120,7 @@ def quick_search(request):
 
 
 @permission_required('crm.view_profile')
+@use_replica
 @render_with('crm/person/list.html')
 def list_people(request):
     form = crm_forms.SearchForm(request.GET)
@@ -168,6 +174,17 @@ def view_person(request, person_id):
     return context
 
 
+@permission_required('crm.view_profile')
+@render_with('crm/person/history.html')
+def person_history(request, person_id):
+    person = get_object_or_404(crm.Contact, pk=person_id, type='individual')
+    records = person.history.select_related('changed_by')
+    return {
+        'contact': person,
+        'history': records,
+    }
+
+
 @render_with('crm/contact/email.html')
 def email_contact(request, contact_slug):
     try:
@@ -194,6 +211,42 @@ def email_contact(request, contact_slug):
     }
 
 
+# thumbnail URLs change with the picture, so they never go stale
+THUMBNAIL_MAX_AGE = 60 * 60 * 24 * 365
+
+
+@login_required
+def contact_thumbnail(request, contact_id, size, picture_hash=None):
+    if size not in thumbnails.sizes():
+        raise Http404
+    contact = get_object_or_404(crm.Contact, pk=contact_id)
+    if not contact.picture:
+        raise Http404
+    if not contact.picture_hash:
+        # uploaded before pictures were hashed; a GET doesn't write, so
+        # this costs a read of the picture until generate_thumbnails runs
+        contact.picture_hash = thumbnails.picture_hash(contact.picture.name)
+    if picture_hash != contact.picture_hash:
+        return HttpResponseRedirect(reverse('contact_thumbnail', kwargs={
+            'contact_id': contact.pk,
+            'size': size,
+            'picture_hash': contact.picture_hash,
+        }))
+    name = thumbnails.make_thumbnail(
+        contact.picture.name,
+        contact.picture_hash,
+        size,
+    )
+    thumbnail = thumbnails.storage().open(name)
+    try:
+        response = HttpResponse(thumbnail.read(), mimetype='image/jpeg')
+    finally:
+        thumbnail.close()
+    response['Cache-Control'] = 'private, max-age=%d' % THUMBNAIL_MAX_AGE
+    response['Expires'] = http_date(time.time() + THUMBNAIL_MAX_AGE)
+    return response
+
+
 @login_required
 @transaction.commit_on_success
 @render_with('crm/person/create_edit.html')
@@ -213,9 +266,6 @@ def create_edit_person(request, person_id=None):
         return HttpResponseRedirect(reverse('auth_login'))
     
     if request.POST:
-        pre_save = ''
-        if profile:
-            pre_save = profile.as_text_block()
         profile_form = crm_forms.ProfileForm(
             request.POST,
             instance=profile,
@@ -243,25 +293,32 @@ def create_edit_person(request, person_id=None):
             else:
                 message = 'New person created successfully'
             request.notifications.add(message)
-            post_save = saved_profile.as_text_block()
             
-            try:
-                group = Group.objects.get(name='Contact Notifications')
-            except Group.DoesNotExist:
-                group = None
-            if group and post_save != pre_save:
+            changes = history.changes_in([profile_form])
+            changes.extend(history.changes_in(location_context))
+            if changes:
+                record = crm.ContactHistory(
+                    contact=saved_profile,
+                    changed_by=request.user,
+                )
+                record.set_changes(changes)
+                record.save()
+            
+            recipients = changes and \
+                notifications.recipients('contact_changed')
+            if recipients:
                 body = "At %s, %s %s changed the profile of %s:\n\n%s" % (
                     datetime.datetime.now(),
                     request.user.first_name,
                     request.user.last_name,
                     saved_profile,
-                    ''.join(list(difflib.ndiff(pre_save, post_save))),
+                    history.format_changes(changes),
                 )
                 send_mail(
                     'CRM Contact Update: %s' % saved_profile,
                     body,
                     settings.DEFAULT_FROM_EMAIL,
-                    [u.email for u in group.user_set.all()],
+                    recipients,
                 )
             
             if 'associate' in request.REQUEST:
@@ -318,8 +375,7 @@ def register_person(request):
     return context
 
 
-@permission_required('crm.add_interaction')
-@permission_required('crm.change_interaction')
+@permission_required('crm.add_interaction', 'crm.change_interaction')
 @render_with('crm/interaction/create_edit.html')
 def create_edit_interaction(request, person_id=None, interaction_id=None):
     if interaction_id:
@@ -371,6 +427,7 @@ def remove_interaction(request, interaction_id):
 
 
 @permission_required('crm.view_interaction')
+@use_replica
 @render_with('crm/interaction/list.html')
 def list_interactions(request):
     form = crm_forms.SearchForm(request.GET)
@@ -408,6 +465,7 @@ def list_interactions(request):
 
 
 @permission_required('crm.view_business')
+@use_replica
 @render_with('crm/business/list.html')
 def list_businesses(request):
     form = crm_forms.SearchForm(request.GET)
@@ -443,9 +501,8 @@ def view_business(request, business):
         'add_contact_form': add_contact_form,
     }
     
-    try:
-        from minibooks.ledger.models import Exchange
-        exchanges = Exchange.objects.filter(business=business)
+    if ledger:
+        exchanges = ledger.Exchange.objects.filter(business=business)
         if business.business_projects.count() > 0:
             exchanges = exchanges.filter(
                 Q(transactions__project__isnull=True) |
@@ -460,14 +517,11 @@ def view_business(request, business):
             exchanges.filter(type__deliverable=True).count() > 0
         context['exchanges'] = exchanges
         context['show_delivered_column'] = show_delivered_column
-    except ImportError:
-        pass
     
     return context
 
 
-@permission_required('crm.add_business')
-@permission_required('crm.change_business')
+@permission_required('crm.add_business', 'crm.change_business')
 @render_with('crm/business/create_edit.html')
 def create_edit_business(request, business=None):
     location = None
@@ -550,14 +604,9 @@ def edit_business_relationship(request, business, user_id):
     return context
 
 @csrf_exempt
-@permission_required('crm.change_business')
-@permission_required('crm.change_project')
+@permission_required('crm.change_business', 'crm.change_project')
 @transaction.commit_on_success
 def associate_contact(request, business, project=None, user_id=None, action=None):
-    try:
-        from timepiece import models as timepiece
-    except ImportError:
-        timpiece = None
     if action == 'add':
         if request.POST or 'associate' in request.REQUEST:
             form = crm_forms.AssociateContactForm(request.POST)
@@ -594,10 +643,12 @@ def associate_contact(request, business, project=None, user_id=None, action=None
                     to_contact=contact,
                     from_contact=business,
                 ).delete()
-        except crm.Contact.DoesNotExist, timepiece.ProjectRelationship.DoesNotExist:
+        except ObjectDoesNotExist:
+            # the contact or relationship is already gone
             user = None
     return HttpResponseRedirect(request.REQUEST['next'])
 
+@use_replica
 @render_with('crm/person/address_book.xml')
 def address_book(request, file_name):
     # WARNING: There is no security on this view.  Enable it with caution!
@@ -646,7 +697,11 @@ def activate_login(request, activation_key):
         if form.is_valid():
             password = form.cleaned_data['password1']
             user = login_registration.activate(password)
-            user.groups = login_registration.groups.all()
+            if user is None:
+                request.notifications.add(
+                    'This account is already active.  Please use the form below to login or reset your password.'
+                )
+                return HttpResponseRedirect(reverse('auth_login'))
             user = authenticate(username=user.username, password=password)
             if user is not None and user.is_active:
                 login(request, user)
@@ -672,26 +727,58 @@ def activate_login(request, activation_key):
 @transaction.commit_on_success
 @render_with('crm/login_registration/create.html')
 def create_registration(request):
-    ids = request.GET.getlist('ids')
+    token = request.GET.get('selection')
+    if token:
+        contacts = selections.get_selection(request, token)
+        if contacts is None:
+            raise Http404
+    else:
+        contacts = selections.Selection(
+            ids=[int(pk) for pk in request.GET.getlist('ids')],
+        )
     if request.POST:
         form = crm_forms.RegistrationGroupForm(request.POST)
         if form.is_valid():
-            emails = []
+            sent = 0
             groups = form.cleaned_data['groups']
-            for contact in crm.Contact.objects.filter(pk__in=ids):
-                profile = \
-                    crm.LoginRegistration.objects.create_pending_login(contact)
-                if profile:
-                    profile.groups = groups
-                    emails.append(profile.prepare_email(send=False))
-            if emails:
-                send_mass_mail(emails)
+            for chunk in contacts.chunks():
+                emails = []
+                for contact in chunk:
+                    profile = crm.LoginRegistration.objects.create_pending_login(
+                        contact,
+                    )
+                    if profile:
+                        profile.groups = groups
+                        emails.append(profile.prepare_email(send=False))
+                if emails:
+                    send_mass_mail(emails)
+                    sent += len(emails)
+            if token:
+                selections.discard_selection(request, token)
             request.notifications.add(
-                "Successfully sent %d emails" % len(emails),
+                "Successfully sent %d emails" % sent,
             )
             return HttpResponseRedirect('/')
     else:
         form = crm_forms.RegistrationGroupForm()
     return {
         'form': form,
+        'selection_count': contacts.count(),
     }
+
+
+@user_passes_test(lambda u: u.is_staff)
+def view_stats(request):
+    """
+    Per-view histograms collected by render_with when CRM_VIEW_STATS is
+    enabled.  POST to start counting afresh.
+    """
+    if request.method == 'POST':
+        stats.view_stats.reset()
+    return HttpResponse(
+        json.dumps({
+            'enabled': stats.enabled(),
+            'views': stats.view_stats.snapshot(),
+        }, indent=2),
+        mimetype='application/json',
+    )
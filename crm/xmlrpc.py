@@ -19,18 +19,20 @@ from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 
 from django.conf import settings
 from django.http import HttpResponse
+from django.core.cache import cache
+from django.db.models import Q
 from django.contrib import auth
 from django.core.validators import email_re
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 
+from contactinfo import models as contactinfo
+
 from crm import models as crm
+from crm import caching
 from crm.decorators import has_perm_or_basicauth
-
-try:
-    from timepiece import models as timepiece
-except ImportError:
-    timepiece = None
+from crm.routers import use_replica
+from crm.integrations import timepiece
 
 try:
     # Python 2.5
@@ -38,6 +40,9 @@ try:
 except:
     # Python 2.4
     dispatcher = SimpleXMLRPCDispatcher()
+dispatcher.register_multicall_functions()
+
+DEFAULT_XMLRPC_CACHE_SECONDS = 60 * 60
 
 
 @csrf_exempt
@@ -61,52 +66,195 @@ def rpc_handler(request):
     return response
 
 
-def _get_contact(username):
-    if email_re.search(username):
-        try:
-            contact = crm.Contact.objects.get(user__email=username)
-        except crm.Contact.DoesNotExist:
-            contact = None
-    else:
-        try:
-            contact = crm.Contact.objects.get(user__username=username)
-        except crm.Contact.DoesNotExist:
-            contact = None
-    return contact
-
-
 def authenticate(username, password):
     return bool(auth.authenticate(username=username, password=password))
 dispatcher.register_function(authenticate, 'authenticate')
 
 
+def _query_contact_ids(usernames):
+    """
+    Resolves usernames, and e-mail addresses through the address of the
+    contact's user account (not the contact's own address), in one query.
+    Addresses match case-insensitively, backed by the index on
+    UPPER(auth_user.email) from migration 013.
+    """
+    emails = [
+        crm.normalize_email(u) for u in usernames if email_re.search(u)
+    ]
+    names = [u for u in usernames if not email_re.search(u)]
+    query = Q(user__username__in=names)
+    for email in emails:
+        query |= Q(user__email__iexact=email)
+    contacts = crm.Contact.objects.filter(query).values_list(
+        'pk',
+        'user__username',
+        'user__email',
+    )
+    by_username = {}
+    by_email = {}
+    for pk, username, email in contacts:
+        by_username[username] = pk
+        by_email[crm.normalize_email(email)] = pk
+    contact_ids = {}
+    for username in usernames:
+        if email_re.search(username):
+            contact_ids[username] = by_email.get(crm.normalize_email(username))
+        else:
+            contact_ids[username] = by_username.get(username)
+    return contact_ids
+
+
+def _get_contact_ids(usernames):
+    """
+    Resolves many usernames and/or e-mail addresses at once, returning a
+    dictionary of username to contact id for the ones that match a contact.
+    
+    Resolved ids (including misses) are cached until a user's username or
+    e-mail or a contact's user changes.
+    """
+    generation = caching.get_generation('contacts')
+    keys = dict([
+        (caching.make_key('contact-id', generation, u), u) for u in usernames
+    ])
+    contact_ids = {}
+    for key, contact_id in cache.get_many(keys.keys()).iteritems():
+        contact_ids[keys[key]] = contact_id
+    missing = [u for u in set(usernames) if u not in contact_ids]
+    if missing:
+        resolved = _query_contact_ids(missing)
+        new_keys = {}
+        for username in missing:
+            # cache misses as 0 so they aren't confused with expired keys
+            contact_ids[username] = resolved[username] or 0
+            key = caching.make_key('contact-id', generation, username)
+            new_keys[key] = contact_ids[username]
+        cache.set_many(new_keys, _cache_timeout())
+    return dict([(u, pk) for u, pk in contact_ids.iteritems() if pk])
+
+
+def _cache_timeout():
+    # generation bumps only reach other workers through a shared cache
+    return caching.timeout(getattr(
+        settings,
+        'CRM_XMLRPC_CACHE_SECONDS',
+        DEFAULT_XMLRPC_CACHE_SECONDS,
+    ))
+
+
 def project_relationships(project_trac_env, username):
-    groups = []
-    contact = _get_contact(username)
-    if contact:
-        groups = crm.RelationshipType.objects.filter(
-            project_relationships__contact=contact,
-            project_relationships__project__trac_environment=project_trac_env,
-        ).values_list('slug', flat=True)
-    return list(groups)
+    return project_relationships_batch(project_trac_env, [username])[0]
 dispatcher.register_function(project_relationships, 'project_relationships')
 
 
-def callerid(number):
+def project_relationships_batch(project_trac_env, usernames):
+    """
+    Returns the relationship slugs of each of the given usernames on the
+    project, as a list in the same order as usernames.
+    
+    Results are cached per project and username until a relationship,
+    project or contact changes.
+    """
+    generation = '%s-%s' % (
+        caching.get_generation('contacts'),
+        caching.get_generation('project_relationships'),
+    )
+    keys = dict([(
+        caching.make_key(
+            'project-relationships',
+            generation,
+            project_trac_env,
+            username,
+        ),
+        username,
+    ) for username in usernames])
+    groups = {}
+    for key, slugs in cache.get_many(keys.keys()).iteritems():
+        groups[keys[key]] = slugs
+    missing = [u for u in set(usernames) if u not in groups]
+    if missing:
+        contact_ids = _get_contact_ids(missing)
+        contact_groups = {}
+        if timepiece:
+            # values_list() can't follow the many-to-many itself, so read its
+            # table
+            types = timepiece.ProjectRelationship._meta.get_field('types')
+            relationship = types.m2m_field_name()
+            environment = '%s__project__trac_environment' % relationship
+            slugs = types.rel.through.objects.filter(**{
+                '%s__contact__in' % relationship: set(contact_ids.values()),
+                environment: project_trac_env,
+            }).values_list(
+                '%s__contact' % relationship,
+                '%s__slug' % types.m2m_reverse_field_name(),
+            )
+            for contact_id, slug in slugs:
+                contact_groups.setdefault(contact_id, []).append(slug)
+        new_keys = {}
+        for username in missing:
+            groups[username] = contact_groups.get(contact_ids.get(username), [])
+            key = caching.make_key(
+                'project-relationships',
+                generation,
+                project_trac_env,
+                username,
+            )
+            new_keys[key] = groups[username]
+        cache.set_many(new_keys, _cache_timeout())
+    return [groups[u] for u in usernames]
+dispatcher.register_function(
+    project_relationships_batch,
+    'project_relationships_batch',
+)
+
+
+def _normalize_number(number):
     number = re.sub('[^0-9]', '', number)
     if number.startswith('1'):
         number = number[1:]
     parts = (number[0:3], number[3:6], number[6:10])
-    number = '-'.join(parts)
-    
-    try:
-        user = User.objects.get(contacts__locations__phones__number=number)
-        return user.get_full_name()
-    except User.DoesNotExist:
-        try:
-            business = \
-              crm.Business.objects.get(locations__phones__number=number)
-            return business.name
-        except crm.Business.DoesNotExist:
-            return number
+    return '-'.join(parts)
+
+
+def callerid(number):
+    return callerid_batch([number])[0]
 dispatcher.register_function(callerid, 'callerid')
+
+
+@use_replica
+def callerid_batch(numbers):
+    """
+    Returns the caller id name for each of the given phone numbers, as a
+    list in the same order as numbers.  Users take precedence over
+    businesses, and unknown numbers are returned normalized.  When several
+    users (or businesses) share a number, the oldest contact's name wins.
+    """
+    numbers = [_normalize_number(number) for number in numbers]
+    # values_list() can't follow the locations many-to-many or the phones
+    # reverse key, so go from the phones to the contact/location table
+    phones = {}
+    for location_id, number in contactinfo.Phone.objects.filter(
+        number__in=set(numbers),
+    ).values_list('location', 'number'):
+        phones.setdefault(location_id, set()).add(number)
+    contacts = crm.Contact.locations.through.objects.filter(
+        location__in=phones.keys(),
+    ).filter(
+        Q(contact__user__isnull=False) | Q(contact__type='business')
+    ).order_by('contact').values_list(
+        'location',
+        'contact__type',
+        'contact__name',
+        'contact__user__first_name',
+        'contact__user__last_name',
+    )
+    users = {}
+    businesses = {}
+    for location_id, type, name, first_name, last_name in contacts:
+        for number in phones[location_id]:
+            if type == 'business':
+                businesses.setdefault(number, name)
+            else:
+                full_name = ('%s %s' % (first_name, last_name)).strip()
+                users.setdefault(number, full_name)
+    return [users.get(n, businesses.get(n, n)) for n in numbers]
+dispatcher.register_function(callerid_batch, 'callerid_batch')